@@ -0,0 +1,427 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from cache import LRUCache
+import metrics
+
+# Cấu hình qua biến môi trường, AI_API_URL có thể trỏ tới server giả lập khi test
+AI_API_URL = os.environ.get('AI_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+# Không đặt AI_API_KEY thì chat chỉ trả lời dự phòng, không gọi upstream
+AI_API_KEY = os.environ.get('AI_API_KEY', '')
+AI_MODEL = os.environ.get('AI_MODEL', 'openai/gpt-oss-120b')
+AI_CONNECT_TIMEOUT = float(os.environ.get('AI_CONNECT_TIMEOUT', 3))
+AI_TIMEOUT = float(os.environ.get('AI_TIMEOUT', 10))
+AI_POOL_SIZE = int(os.environ.get('AI_POOL_SIZE', 10))
+AI_CACHE_MB = int(os.environ.get('AI_CACHE_MB', 4))
+AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', 3600))
+# Ngắt mạch: sau N lỗi/chậm liên tiếp thì trả lời dự phòng ngay trong COOLDOWN giây
+AI_BREAKER_FAILURES = int(os.environ.get('AI_BREAKER_FAILURES', 3))
+AI_BREAKER_COOLDOWN = float(os.environ.get('AI_BREAKER_COOLDOWN', 30))
+AI_SLOW_SECONDS = float(os.environ.get('AI_SLOW_SECONDS', 6))
+
+SYSTEM_PROMPT = ('Bạn là AI trợ lý Python. Trả lời ngắn gọn, không dùng ký tự đặc biệt như * | `. '
+                 'Code phải xuống dòng rõ ràng. Tối đa 3-4 câu.')
+MAX_TOKENS = 200
+TEMPERATURE = 0.3
+
+logger = logging.getLogger('ai_client')
+
+BUSY_RESPONSE = 'AI đang bận. Thử lại sau!'
+DEFAULT_FALLBACK = 'Tôi giúp học Python.'
+FALLBACK_RESPONSES = {
+    'xin chào': 'Chào bạn! Tôi giúp học Python.',
+    'hello': 'Hi! Tôi giúp học Python.',
+    'python': 'Python dễ học. Bạn cần gì?'
+}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+def fallback_response(message):
+    for key, value in FALLBACK_RESPONSES.items():
+        if key in message.lower():
+            return value
+    return DEFAULT_FALLBACK
+
+
+def normalize_prompt(message):
+    # "Vòng lặp for là gì?" và "  vòng lặp FOR là gì " dùng chung một câu trả lời
+    text = re.sub(r'\s+', ' ', message.lower()).strip()
+    return text.rstrip('?!.… ')
+
+
+class CircuitBreaker:
+    # closed -> open sau AI_BREAKER_FAILURES lỗi; hết cooldown cho một request thử (half-open)
+    def __init__(self, failures, cooldown):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self.trips = 0
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._count = 0
+                self._opened_at = None
+                return
+            self._count += 1
+            if self._opened_at is not None or self._count >= self.failures:
+                if self._opened_at is None:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return 'open'
+            return 'half-open'
+
+
+class _Pending:
+    # Câu hỏi đang chờ upstream: leader stream ghi từng đoạn vào parts, người đến sau đọc lại
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.waiters = 0
+        self.parts = []
+        self._changed = threading.Condition()
+
+    def add(self, delta):
+        with self._changed:
+            self.parts.append(delta)
+            self._changed.notify_all()
+
+    def finish(self, result):
+        with self._changed:
+            self.result = result
+            self.done.set()
+            self._changed.notify_all()
+
+    def replay(self, timeout):
+        # Sinh các đoạn của leader theo thứ tự tới khi leader xong; quá timeout không có đoạn mới thì dừng
+        index = 0
+        while True:
+            with self._changed:
+                if index == len(self.parts) and not self.done.is_set():
+                    self._changed.wait(timeout)
+                new = self.parts[index:]
+                finished = self.done.is_set()
+            if not new and not finished:
+                return
+            index += len(new)
+            for delta in new:
+                yield delta
+            if finished:
+                return
+
+
+class AIClient:
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=AI_POOL_SIZE)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        if AI_API_KEY:
+            self.session.headers['Authorization'] = 'Bearer %s' % AI_API_KEY
+        else:
+            logger.warning('AI_API_KEY chưa được đặt: chat AI chỉ dùng câu trả lời dự phòng')
+        self.cache = LRUCache(AI_CACHE_MB * 1024 * 1024, ttl=AI_CACHE_TTL)
+        self.breaker = CircuitBreaker(AI_BREAKER_FAILURES, AI_BREAKER_COOLDOWN)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.counts = {'upstream': 0, 'cache': 0, 'coalesced': 0, 'fallback': 0, 'busy': 0}
+        self.ttft = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+    def _count(self, source):
+        with self._lock:
+            self.counts[source] += 1
+
+    def _payload(self, message, stream=False):
+        data = {
+            'model': AI_MODEL,
+            'messages': [
+                {'role': 'system', 'content': SYSTEM_PROMPT},
+                {'role': 'user', 'content': message}
+            ],
+            'max_tokens': MAX_TOKENS,
+            'temperature': TEMPERATURE
+        }
+        if stream:
+            data['stream'] = True
+        return data
+
+    def _request(self, message):
+        data = self._payload(message)
+        start = time.monotonic()
+        try:
+            response = self.session.post(AI_API_URL, json=data, timeout=(AI_CONNECT_TIMEOUT, AI_TIMEOUT))
+        except requests.RequestException as e:
+            self.breaker.record(False)
+            raise UpstreamError(str(e))
+        metrics.observe_upstream('ai', 'response', time.monotonic() - start)
+        slow = time.monotonic() - start > AI_SLOW_SECONDS
+        if response.status_code != 200:
+            # 4xx do request của mình, không phải upstream hỏng
+            self.breaker.record(response.status_code < 500 and response.status_code != 429 and not slow)
+            return None
+        try:
+            text = response.json()['choices'][0]['message']['content']
+        except (ValueError, LookupError, TypeError) as e:
+            self.breaker.record(False)
+            raise UpstreamError(str(e))
+        self.breaker.record(not slow)
+        return text
+
+    def _call(self, message):
+        # Trả về (câu trả lời, nguồn); chỉ cache câu trả lời thật từ upstream
+        if not AI_API_KEY or not self.breaker.allow():
+            return fallback_response(message), 'fallback'
+        try:
+            text = self._request(message)
+        except UpstreamError:
+            return fallback_response(message), 'fallback'
+        if text is None:
+            return BUSY_RESPONSE, 'busy'
+        return text, 'upstream'
+
+    def ask(self, message):
+        key = hashlib.sha256(normalize_prompt(message).encode()).hexdigest()
+        cached = self.cache.get(key)
+        if cached is not None:
+            self._count('cache')
+            return cached, 'cache'
+
+        # Gộp các câu hỏi giống nhau đang chờ: chỉ một request ra upstream
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _Pending()
+            else:
+                pending.waiters += 1
+        if not leader:
+            pending.done.wait(AI_CONNECT_TIMEOUT + AI_TIMEOUT + 1)
+            if pending.result is not None:
+                self._count('coalesced')
+                return pending.result[0], 'coalesced'
+            self._count('fallback')
+            return fallback_response(message), 'fallback'
+
+        try:
+            text, source = self._call(message)
+            if source == 'upstream':
+                self.cache.set(key, text, len(text.encode()) + len(key))
+        except Exception:
+            text, source = fallback_response(message), 'fallback'
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.finish((text, source))
+        self._count(source)
+        return text, source
+
+    def _record_ttft(self, ttft_ms):
+        with self._lock:
+            self.ttft['count'] += 1
+            self.ttft['total_ms'] += ttft_ms
+            self.ttft['max_ms'] = max(self.ttft['max_ms'], ttft_ms)
+
+    def _stream_upstream(self, message):
+        # Đọc từng chunk SSE của upstream ("data: {...}" ... "data: [DONE]")
+        start = time.monotonic()
+        try:
+            response = self.session.post(AI_API_URL, json=self._payload(message, stream=True),
+                                         timeout=(AI_CONNECT_TIMEOUT, AI_TIMEOUT), stream=True)
+        except requests.RequestException as e:
+            self.breaker.record(False)
+            raise UpstreamError(str(e))
+        with response:
+            if response.status_code != 200:
+                self.breaker.record(response.status_code < 500 and response.status_code != 429)
+                yield None
+                return
+            first = True
+            try:
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not line or not line.startswith('data:'):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == '[DONE]':
+                        break
+                    delta = json.loads(payload)['choices'][0].get('delta', {}).get('content')
+                    if not delta:
+                        continue
+                    if first:
+                        first = False
+                        metrics.observe_upstream('ai', 'first_token', time.monotonic() - start)
+                        self.breaker.record(time.monotonic() - start <= AI_SLOW_SECONDS)
+                    yield delta
+            except (requests.RequestException, ValueError, LookupError, TypeError, AttributeError) as e:
+                # Chunk hỏng giữa chừng cũng tính là upstream lỗi
+                self.breaker.record(False)
+                raise UpstreamError(str(e))
+            if first:
+                self.breaker.record(True)
+
+    def stream(self, message):
+        # Sinh {'delta': ...} theo từng đoạn, cuối cùng là {'done': True, 'source', 'ttft_ms', 'time_ms'}
+        start = time.monotonic()
+        key = hashlib.sha256(normalize_prompt(message).encode()).hexdigest()
+
+        def finish(source, ttft):
+            self._count(source)
+            ttft_ms = round((ttft - start) * 1000, 1) if ttft is not None else None
+            # Thống kê chỉ tính các câu trả lời thật từ upstream
+            if source == 'upstream' and ttft_ms is not None:
+                self._record_ttft(ttft_ms)
+            return {'done': True, 'source': source, 'ttft_ms': ttft_ms,
+                    'time_ms': round((time.monotonic() - start) * 1000, 1)}
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield {'delta': cached}
+            yield finish('cache', time.monotonic())
+            return
+
+        # Gộp như ask(): chỉ một request ra upstream, người đến sau đọc lại các đoạn của leader
+        with self._lock:
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending[key] = _Pending()
+            else:
+                pending.waiters += 1
+        if not leader:
+            ttft = None
+            for delta in pending.replay(AI_CONNECT_TIMEOUT + AI_TIMEOUT + 1):
+                if ttft is None:
+                    ttft = time.monotonic()
+                yield {'delta': delta}
+            if pending.result is not None:
+                if ttft is None:
+                    # Leader là ask() hoặc trả lời dự phòng: không có đoạn nào, chỉ có kết quả cuối
+                    ttft = time.monotonic()
+                    yield {'delta': pending.result[0]}
+                yield finish('coalesced', ttft)
+            elif ttft is not None:
+                yield {'error': 'Kết nối AI bị gián đoạn'}
+                yield finish('coalesced', ttft)
+            else:
+                yield {'delta': fallback_response(message)}
+                yield finish('fallback', time.monotonic())
+            return
+
+        def release(result=None):
+            # Trả kết quả cho người chờ trước khi gửi sự kiện cuối; client ngắt giữa chừng thì kết quả là None
+            if not pending.done.is_set():
+                with self._lock:
+                    del self._pending[key]
+                pending.finish(result)
+
+        try:
+            if not AI_API_KEY or not self.breaker.allow():
+                release((fallback_response(message), 'fallback'))
+                yield {'delta': fallback_response(message)}
+                yield finish('fallback', time.monotonic())
+                return
+
+            parts = []
+            ttft = None
+            try:
+                for delta in self._stream_upstream(message):
+                    if delta is None:
+                        release((BUSY_RESPONSE, 'busy'))
+                        yield {'delta': BUSY_RESPONSE}
+                        yield finish('busy', time.monotonic())
+                        return
+                    if ttft is None:
+                        ttft = time.monotonic()
+                    parts.append(delta)
+                    pending.add(delta)
+                    yield {'delta': delta}
+            except UpstreamError:
+                if not parts:
+                    release((fallback_response(message), 'fallback'))
+                    yield {'delta': fallback_response(message)}
+                    yield finish('fallback', time.monotonic())
+                    return
+                release()
+                yield {'error': 'Kết nối AI bị gián đoạn'}
+                yield finish('upstream', ttft)
+                return
+            text = ''.join(parts)
+            if text:
+                self.cache.set(key, text, len(text.encode()) + len(key))
+            release((text, 'upstream') if text else None)
+            yield finish('upstream', ttft)
+        finally:
+            release()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+            in_flight = len(self._pending)
+            ttft = dict(self.ttft)
+        return {
+            'requests': counts,
+            'ttft_ms': {
+                'count': ttft['count'],
+                'avg': round(ttft['total_ms'] / ttft['count'], 1) if ttft['count'] else None,
+                'max': ttft['max_ms'],
+            },
+            'in_flight': in_flight,
+            'configured': bool(AI_API_KEY),
+            'breaker': {'state': self.breaker.state(), 'trips': self.breaker.trips},
+            'cache': self.cache.stats(),
+        }
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # Mỗi process một session riêng, không dùng chung socket keep-alive sau fork
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = AIClient()
+            _client_pid = os.getpid()
+        return _client
+
+
+def ask(message):
+    return get_client().ask(message)
+
+
+def stream(message):
+    return get_client().stream(message)
+
+
+def ai_stats():
+    return get_client().stats()
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+from flask import abort, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# File tĩnh được sao ra thư mục build với tên chứa hash nội dung (css/style.3f2a9c1d0b4e.css),
+# kèm bản nén sẵn .gz/.br. Tên đổi khi nội dung đổi nên trình duyệt được cache vĩnh viễn.
+ASSET_BUILD_DIR = os.environ.get('ASSET_BUILD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                   'static_build'))
+ASSET_MAX_AGE = 365 * 24 * 3600
+# File nhỏ hơn ngưỡng này nén không đáng (header còn lớn hơn phần tiết kiệm được)
+COMPRESS_MIN_BYTES = 1024
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+MANIFEST = 'manifest.json'
+
+_manifest = {}
+
+
+def _fingerprint(path, data):
+    root, ext = os.path.splitext(path)
+    return '%s.%s%s' % (root, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def _write(path, data):
+    # Ghi ra file tạm rồi rename: worker khác không bao giờ đọc phải file ghi dở
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    # mkstemp tạo file 0600; nginx phục vụ thẳng thư mục build cần đọc được
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def build(static_folder, build_dir=ASSET_BUILD_DIR):
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            hashed = _fingerprint(path, data)
+            manifest[path] = hashed
+            target = os.path.join(build_dir, hashed)
+            if os.path.exists(target):
+                continue
+            _write(target, data)
+            if path.endswith(COMPRESSIBLE) and len(data) >= COMPRESS_MIN_BYTES:
+                _write(target + '.gz', gzip.compress(data, 9, mtime=0))
+                if brotli:
+                    _write(target + '.br', brotli.compress(data, quality=11))
+    _write(os.path.join(build_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load(static_folder, build_dir=ASSET_BUILD_DIR):
+    # Build lại nếu manifest chưa có hoặc cũ hơn file tĩnh nào đó
+    global _manifest
+    manifest_path = os.path.join(build_dir, MANIFEST)
+    try:
+        built_at = os.path.getmtime(manifest_path)
+        stale = any(os.path.getmtime(os.path.join(root, name)) > built_at
+                    for root, _, files in os.walk(static_folder) for name in files)
+    except OSError:
+        stale = True
+    if stale:
+        _manifest = build(static_folder, build_dir)
+    else:
+        with open(manifest_path) as f:
+            _manifest = json.load(f)
+    return _manifest
+
+
+def asset_url(filename):
+    # Dùng trong template thay cho url_for('static', ...)
+    hashed = _manifest.get(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('asset', filename=hashed)
+
+
+def serve_asset(filename):
+    path = safe_join(ASSET_BUILD_DIR, filename)
+    if path is None or filename == MANIFEST or filename.endswith(('.gz', '.br')) or not os.path.isfile(path):
+        abort(404)
+    mimetype = None
+    encoding = None
+    accepted = request.accept_encodings
+    for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if accepted[name] and os.path.isfile(path + suffix):
+            encoding = name
+            break
+    if encoding:
+        # mimetype lấy theo file gốc, không phải đuôi .br/.gz
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        path += '.br' if encoding == 'br' else '.gz'
+    # send_file dùng wsgi.file_wrapper (sendfile) hoặc X-Sendfile nếu bật USE_X_SENDFILE
+    response = send_file(path, mimetype=mimetype, max_age=ASSET_MAX_AGE, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % ASSET_MAX_AGE
+    return response
+
+
+def init_app(app):
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
+    app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE') == '1'
+    load(app.static_folder)
@@ -0,0 +1,314 @@
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Chạy: python benchmark.py --concurrency 8 --duration 10 --save-baseline bench.json
+#       python benchmark.py --concurrency 8 --duration 10 --compare bench.json
+ROUTES = ('lessons', 'lesson', 'qa', 'question', 'search', 'run_code', 'chat')
+BENCH_USER = 'bench'
+BENCH_PASSWORD = 'bench-password'
+
+WORDS = ('biến', 'vòng lặp', 'hàm', 'danh sách', 'từ điển', 'chuỗi', 'lớp', 'đối tượng', 'ngoại lệ',
+         'module', 'tệp', 'điều kiện', 'đệ quy', 'list comprehension', 'generator', 'decorator')
+PROGRAMS = ['print(sum(range(%d)))' % n for n in range(10)] + \
+           ['for i in range(%d):\n    print(i * i)' % n for n in range(10)]
+PROMPTS = ['%s là gì?' % word for word in WORDS] + ['Cách dùng %s trong Python' % word for word in WORDS]
+# Route có cache kết quả (sandbox / AI): đo riêng request trúng cache và request chắc chắn trượt cache
+CACHED_ROUTES = ('run_code', 'chat')
+
+
+class StubUpstream(BaseHTTPRequestHandler):
+    # Giả lập API chat completions với độ trễ cố định
+    protocol_version = 'HTTP/1.1'
+    latency = 0.2
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency)
+        answer = 'Trả lời cho: %s' % body['messages'][-1]['content']
+        if body.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for word in answer.split(' ') + ['[DONE]']:
+                data = '[DONE]' if word == '[DONE]' else json.dumps({'choices': [{'delta': {'content': word + ' '}}]})
+                chunk = ('data: %s\n\n' % data).encode()
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.write(b'0\r\n\r\n')
+            return
+        data = json.dumps({'choices': [{'message': {'content': answer}}]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed(args):
+    # Dữ liệu cố định theo --seed để các lần chạy so sánh được với nhau
+    import passwords
+    import repository
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    password_hash = passwords.hash_password(BENCH_PASSWORD)
+    repository.create_user(BENCH_USER, password_hash)
+    for i in range(args.users):
+        repository.create_user('user%d' % i, password_hash)
+    lesson_ids = []
+    for i in range(args.lessons):
+        status = 'approved' if rng.random() < 0.9 else 'pending'
+        lesson_id = repository.create_lesson(
+            'Bài %d: %s' % (i, _text(rng, 3)), _text(rng, 150), PROGRAMS[i % len(PROGRAMS)], _text(rng, 20), '',
+            'user%d' % rng.randrange(max(args.users, 1)), status, 'lesson', PROGRAMS[i % len(PROGRAMS)], _text(rng, 10))
+        # Chỉ đo bài đã duyệt, bài chờ duyệt không mở được với người thường
+        if status == 'approved':
+            lesson_ids.append(lesson_id)
+    question_ids = []
+    for i in range(args.questions):
+        question_id = repository.create_question('Câu hỏi %d về %s' % (i, _text(rng, 2)), _text(rng, 60),
+                                                  'user%d' % rng.randrange(max(args.users, 1)))
+        question_ids.append(question_id)
+        # Phân bố lệch: vài câu hỏi "hot" có rất nhiều câu trả lời
+        answers = int(rng.paretovariate(1.5) * args.answers) - args.answers
+        for _ in range(min(answers, args.answers * 20)):
+            repository.create_answer(question_id, _text(rng, 40), 'user%d' % rng.randrange(max(args.users, 1)))
+    print('seed: %d lessons đã duyệt, %d questions, %d users trong %.1fs' % (
+        len(lesson_ids), len(question_ids), args.users + 1, time.perf_counter() - start))
+    return lesson_ids, question_ids
+
+
+def _request(route, session, base, rng, lesson_ids, question_ids, hit_ratio=1.0):
+    # Trả về (response, 'hit' | 'miss' | None). Request "miss" thêm nonce vào code/câu hỏi
+    # để không trúng cache kết quả chạy code hay cache câu trả lời AI
+    if route in CACHED_ROUTES:
+        kind = 'hit' if rng.random() < hit_ratio else 'miss'
+        nonce = '' if kind == 'hit' else ' %016x' % rng.getrandbits(64)
+        if route == 'run_code':
+            code = rng.choice(PROGRAMS) + ('\n#' + nonce if nonce else '')
+            return session.post(base + '/run_code', json={'code': code}), kind
+        return session.post(base + '/chat', json={'message': rng.choice(PROMPTS) + nonce}), kind
+    return _get(route, session, base, rng, lesson_ids, question_ids), None
+
+
+def _get(route, session, base, rng, lesson_ids, question_ids):
+    if route == 'lessons':
+        return session.get(base + '/lessons')
+    if route == 'lesson':
+        return session.get(base + '/lesson/%d' % rng.choice(lesson_ids))
+    if route == 'qa':
+        return session.get(base + '/qa')
+    if route == 'question':
+        return session.get(base + '/question/%d' % rng.choice(question_ids))
+    if route == 'search':
+        return session.get(base + '/search', params={'q': rng.choice(WORDS)})
+    raise ValueError(route)
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(percent / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def _summary(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def run_route(route, base, args, lesson_ids, question_ids):
+    import requests
+    samples = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = [None]
+
+    def start_clock():
+        deadline[0] = time.perf_counter() + args.duration
+
+    # Mọi client đăng nhập và làm nóng xong mới bắt đầu tính giờ
+    barrier = threading.Barrier(args.concurrency + 1, action=start_clock)
+
+    def client(index):
+        rng = random.Random('%s-%d-%d' % (route, args.seed, index))
+        session = requests.Session()
+        session.post(base + '/auth', data={'action': 'login', 'username': BENCH_USER, 'password': BENCH_PASSWORD})
+        if route in CACHED_ROUTES and index == 0:
+            # Đưa mọi chương trình / câu hỏi cố định vào cache để request "hit" thật sự trúng cache
+            for item in PROGRAMS if route == 'run_code' else PROMPTS:
+                if route == 'run_code':
+                    session.post(base + '/run_code', json={'code': item})
+                else:
+                    session.post(base + '/chat', json={'message': item})
+        for _ in range(args.warmup):
+            _request(route, session, base, rng, lesson_ids, question_ids, args.hit_ratio)
+        barrier.wait()
+        local = []
+        while time.perf_counter() < deadline[0]:
+            start = time.perf_counter()
+            response, kind = _request(route, session, base, rng, lesson_ids, question_ids, args.hit_ratio)
+            local.append((time.perf_counter() - start, kind, response.status_code >= 400))
+        with lock:
+            samples.extend(local)
+            errors[0] += sum(1 for sample in local if sample[2])
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = _summary([sample[0] for sample in samples], errors[0], elapsed)
+    if route in CACHED_ROUTES:
+        for kind in ('hit', 'miss'):
+            selected = [sample for sample in samples if sample[1] == kind]
+            result['cache_' + kind] = _summary([sample[0] for sample in selected],
+                                               sum(1 for sample in selected if sample[2]), elapsed)
+    return result
+
+
+def compare(results, baseline, threshold):
+    # Chậm hơn baseline quá threshold% (rps giảm hoặc p95 tăng) thì tính là regression
+    regressions = []
+    print('\n%-15s %12s %12s' % ('route', 'rps Δ%', 'p95 Δ%'))
+    for name, result, base in _entries(results, baseline):
+        if not base or not base['rps'] or not base['p95_ms']:
+            continue
+        rps_delta = (result['rps'] - base['rps']) * 100 / base['rps']
+        p95_delta = (result['p95_ms'] - base['p95_ms']) * 100 / base['p95_ms']
+        flag = ''
+        if rps_delta < -threshold or p95_delta > threshold:
+            regressions.append(name)
+            flag = '  <-- chậm hơn'
+        print('%-15s %+11.1f%% %+11.1f%%%s' % (name, rps_delta, p95_delta, flag))
+    return regressions
+
+
+def _entries(results, baseline=None):
+    # (tên, kết quả, baseline) cho từng route và phần hit/miss của route có cache
+    baseline = baseline or {}
+    for route, result in results.items():
+        base = baseline.get(route) or {}
+        yield route, result, base
+        for kind in ('cache_hit', 'cache_miss'):
+            if kind in result:
+                yield '%s/%s' % (route, kind[6:]), result[kind], base.get(kind)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Đo throughput và độ trễ các route chính của main.py')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='các route cần đo, cách nhau bởi dấu phẩy')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='số giây đo cho mỗi route')
+    parser.add_argument('--warmup', type=int, default=5, help='số request làm nóng mỗi client')
+    parser.add_argument('--lessons', type=int, default=2000)
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--answers', type=int, default=3, help='số câu trả lời trung bình mỗi câu hỏi')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--db', help='file SQLite (mặc định: file tạm, tạo mới mỗi lần chạy)')
+    parser.add_argument('--postgres', help='DATABASE_URL của Postgres cục bộ thay cho SQLite')
+    parser.add_argument('--upstream-ms', type=float, default=200, help='độ trễ giả lập của API chat')
+    parser.add_argument('--hit-ratio', type=float, default=0.5,
+                        help='tỉ lệ request run_code/chat lặp lại nội dung đã có trong cache (còn lại trượt cache)')
+    parser.add_argument('--save-baseline', help='lưu kết quả làm baseline (JSON)')
+    parser.add_argument('--compare', help='so sánh với baseline đã lưu')
+    parser.add_argument('--threshold', type=float, default=10, help='ngưỡng regression (%%)')
+    args = parser.parse_args()
+
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    for route in routes:
+        if route not in ROUTES:
+            parser.error('route không hợp lệ: %s' % route)
+
+    upstream = ThreadingHTTPServer(('127.0.0.1', 0), StubUpstream)
+    StubUpstream.latency = args.upstream_ms / 1000
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+    # Cấu hình phải đặt trước khi import app
+    if args.postgres:
+        os.environ['DATABASE_URL'] = args.postgres
+    else:
+        os.environ['SQLITE_PATH'] = args.db or os.path.join(tempfile.mkdtemp(prefix='bench-'), 'bench.db')
+    os.environ['AI_API_URL'] = 'http://127.0.0.1:%d/' % upstream.server_port
+    os.environ.setdefault('AI_API_KEY', 'benchmark')
+    os.environ.setdefault('RATE_LIMIT_RUN_CODE', '1000000/1')
+    os.environ.setdefault('RATE_LIMIT_CHAT', '1000000/1')
+    os.environ.setdefault('ADMISSION_RUN_CODE', '100000')
+    os.environ.setdefault('ADMISSION_CHAT', '100000')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from werkzeug.serving import make_server
+    import main as app_module
+    app_module.init_db()
+    lesson_ids, question_ids = seed(args)
+
+    # Log từng request của werkzeug làm chậm và che mất bảng kết quả
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%d' % server.server_port
+
+    results = {}
+    print('\n%-15s %8s %7s %9s %9s %9s %9s' % ('route', 'rps', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for route in routes:
+        results[route] = run_route(route, base, args, lesson_ids, question_ids)
+        for name, result, _ in _entries({route: results[route]}):
+            print('%-15s %8.1f %7d %9.2f %9.2f %9.2f %9.2f' % (name, result['rps'], result['errors'], result['p50_ms'],
+                                                               result['p95_ms'], result['p99_ms'], result['max_ms']))
+    server.shutdown()
+    upstream.shutdown()
+
+    report = {
+        'config': {key: getattr(args, key) for key in ('concurrency', 'duration', 'lessons', 'questions',
+                                                        'answers', 'users', 'seed', 'upstream_ms', 'hit_ratio')},
+        'backend': 'postgres' if args.postgres else 'sqlite',
+        'python': sys.version.split()[0],
+        'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'results': results,
+    }
+    status = 0
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print('\nCảnh báo: cấu hình khác baseline, kết quả có thể không so sánh được')
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print('\nRegression: %s' % ', '.join(regressions))
+            status = 1
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print('\nĐã lưu baseline vào %s' % args.save_baseline)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
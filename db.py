@@ -0,0 +1,475 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_app_context, has_request_context, session
+import metrics
+try:
+    import psycopg2
+    from psycopg2 import extensions as pg_extensions
+    from psycopg2.extras import execute_batch
+except ImportError:
+    psycopg2 = None
+    execute_batch = None
+
+if psycopg2:
+    IntegrityError = (sqlite3.IntegrityError, psycopg2.IntegrityError)
+
+    class PreparedConnection(pg_extensions.connection):
+        # Ghi nhớ các câu lệnh đã PREPARE trên kết nối này
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
+else:
+    IntegrityError = sqlite3.IntegrityError
+
+# SQLite lưu TIMESTAMP dạng 'YYYY-MM-DD HH:MM:SS', đọc ra datetime như Postgres
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' '))
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+# Database configuration
+DATABASE_URL = os.environ.get('DATABASE_URL')
+USE_POSTGRES = bool(DATABASE_URL and psycopg2)
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'python_learning.db')
+
+# Kích thước pool cho Postgres (SQLite dùng 1 kết nối / thread)
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX', 10))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+
+# Replica chỉ đọc: DSN Postgres (hoặc đường dẫn file SQLite khi chạy thử), cách nhau bởi dấu phẩy
+REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Session vừa ghi thì đọc từ primary trong ngần này giây, để thấy ngay dữ liệu mình vừa ghi dù replica còn trễ
+REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+# Replica lỗi bị bỏ qua trong ngần này giây rồi mới thử lại
+REPLICA_RETRY_SECONDS = float(os.environ.get('REPLICA_RETRY_SECONDS', 10))
+# Kết nối lấy từ replica được ping lại nếu lần kiểm tra trước đã cũ hơn ngần này giây
+REPLICA_CHECK_SECONDS = float(os.environ.get('REPLICA_CHECK_SECONDS', 5))
+
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.in_use = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def checked_out(self, waited):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            if waited:
+                self.waits += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def checked_in(self):
+        with self._lock:
+            self.in_use -= 1
+
+    def count(self, name, n=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'created': self.created,
+                'closed': self.closed,
+                'checkouts': self.checkouts,
+                'in_use': self.in_use,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_total_ms': round(self.wait_total * 1000, 3),
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+
+class SQLitePool:
+    # SQLite: mỗi thread giữ lại một kết nối, tái sử dụng qua các request
+    backend = 'sqlite'
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.pid = os.getpid()
+        self.stats = PoolStats()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def _connect(self):
+        if self.readonly:
+            conn = sqlite3.connect('file:%s?mode=ro' % self.path, uri=True, timeout=5, check_same_thread=False,
+                                   cached_statements=256, detect_types=sqlite3.PARSE_DECLTYPES)
+        else:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, cached_statements=256,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        for pragma in SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        if not self.readonly:
+            # Chỉ user chạy app đọc được database (worker chạy code người học dùng user khác)
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.chmod(self.path + suffix, 0o600)
+                except OSError:
+                    pass
+        self.stats.count('created')
+        with self._lock:
+            self._open += 1
+        return conn
+
+    def getconn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        self.stats.checked_out(0)
+        return conn
+
+    def putconn(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.stats.checked_in()
+
+    def closeall(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            self.stats.count('closed')
+            with self._lock:
+                self._open -= 1
+
+    def info(self):
+        with self._lock:
+            size = self._open
+        return {'backend': self.backend, 'size': size, 'max_size': None}
+
+
+class PostgresPool:
+    # Postgres: pool giới hạn kích thước, chờ tối đa POOL_TIMEOUT giây khi hết kết nối
+    backend = 'postgres'
+
+    def __init__(self, dsn, minconn, maxconn, timeout):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self.stats = PoolStats()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        for _ in range(minconn):
+            self._idle.append(self._connect())
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, connection_factory=PreparedConnection)
+        self.stats.count('created')
+        return conn
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if conn.closed:
+                        self._size -= 1
+                        self.stats.count('closed')
+                        continue
+                    self.stats.checked_out(time.monotonic() - start)
+                    return conn
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats.count('timeouts')
+                    raise PoolTimeout('Hết kết nối database trong pool (%d)' % self.maxconn)
+                self._cond.wait(remaining)
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        self.stats.checked_out(time.monotonic() - start)
+        return conn
+
+    def putconn(self, conn):
+        if not conn.closed and conn.info.transaction_status != pg_extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                conn.close()
+        with self._cond:
+            if conn.closed:
+                self._size -= 1
+                self.stats.count('closed')
+            else:
+                self._idle.append(conn)
+            self.stats.checked_in()
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+                self.stats.count('closed')
+            self._size -= len(self._idle)
+            self._idle = []
+
+    def info(self):
+        with self._cond:
+            return {'backend': self.backend, 'size': self._size, 'idle': len(self._idle),
+                    'max_size': self.maxconn}
+
+
+class ReplicaSet:
+    # Chọn replica xoay vòng; replica không kết nối được bị bỏ qua REPLICA_RETRY_SECONDS giây
+    def __init__(self, urls):
+        self.urls = urls
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pools = [None] * len(urls)
+        self._down_until = [0.0] * len(urls)
+        self._checked_at = [0.0] * len(urls)
+        self._next = 0
+        self.reads = [0] * len(urls)
+        self.failures = [0] * len(urls)
+        self.fallbacks = 0
+
+    def _pool(self, index):
+        # Tạo pool khi cần: replica chết lúc khởi động không làm hỏng cả process
+        with self._lock:
+            if self._pools[index] is None:
+                if USE_POSTGRES:
+                    self._pools[index] = PostgresPool(self.urls[index], 0, POOL_MAX_SIZE, POOL_TIMEOUT)
+                else:
+                    self._pools[index] = SQLitePool(self.urls[index], readonly=True)
+            return self._pools[index]
+
+    def getconn(self):
+        # Trả về (index, kết nối) hoặc None nếu không replica nào dùng được (khi đó đọc từ primary)
+        for _ in range(len(self.urls)):
+            now = time.monotonic()
+            with self._lock:
+                index = self._next
+                self._next = (index + 1) % len(self.urls)
+                if self._down_until[index] > now:
+                    continue
+                check = now - self._checked_at[index] >= REPLICA_CHECK_SECONDS
+            pool = self._pool(index)
+            conn = None
+            try:
+                conn = pool.getconn()
+                if check:
+                    cur = conn.cursor()
+                    cur.execute('SELECT 1')
+                    cur.fetchone()
+                    cur.close()
+                    with self._lock:
+                        self._checked_at[index] = now
+            except Exception:
+                if conn is not None:
+                    if USE_POSTGRES:
+                        conn.close()
+                        pool.putconn(conn)
+                    else:
+                        pool.putconn(conn)
+                        pool.closeall()
+                with self._lock:
+                    self.failures[index] += 1
+                    self._down_until[index] = now + REPLICA_RETRY_SECONDS
+                continue
+            with self._lock:
+                self.reads[index] += 1
+            return index, conn
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def putconn(self, index, conn):
+        self._pools[index].putconn(conn)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'fallbacks': self.fallbacks,
+                'replicas': [{'index': i, 'up': self._down_until[i] <= now, 'reads': self.reads[i],
+                              'failures': self.failures[i]} for i in range(len(self.urls))],
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_replicas = None
+
+
+def get_pool():
+    global _pool
+    # Tạo lại pool sau khi fork (mỗi worker process có pool riêng)
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                if USE_POSTGRES:
+                    _pool = PostgresPool(DATABASE_URL, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT)
+                else:
+                    _pool = SQLitePool(SQLITE_PATH)
+    return _pool
+
+
+def get_replicas():
+    global _replicas
+    if not REPLICA_URLS:
+        return None
+    if _replicas is None or _replicas.pid != os.getpid():
+        with _pool_lock:
+            if _replicas is None or _replicas.pid != os.getpid():
+                _replicas = ReplicaSet(REPLICA_URLS)
+    return _replicas
+
+
+def prefer_primary():
+    # Phần còn lại của request đọc từ primary (ví dụ trang sắp được lưu vào page cache)
+    if has_app_context():
+        g.db_primary = True
+
+
+def _mark_written():
+    if REPLICA_URLS and has_request_context():
+        session['_db_primary_until'] = time.time() + REPLICA_STICKY_SECONDS
+    # Các lần đọc sau trong cùng request cũng phải thấy dữ liệu vừa ghi: bỏ kết nối replica đang giữ
+    if has_app_context():
+        g.db_primary = True
+        _release_replica()
+
+
+def _release_replica():
+    replica = g.pop('db_replica', None)
+    if replica is not None:
+        get_replicas().putconn(*replica)
+
+
+def _use_replica():
+    # Đã dùng primary trong request này (có thể vừa ghi) thì đọc tiếp ở primary
+    if not REPLICA_URLS or 'db_conn' in g or g.get('db_primary'):
+        return False
+    return not (has_request_context() and session.get('_db_primary_until', 0) > time.time())
+
+
+def close_pool():
+    # Đóng kết nối của process hiện tại, ví dụ ở process master trước khi fork worker
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+def get_db_connection(readonly=False):
+    # Trong request: một kết nối cho cả request, trả lại pool khi kết thúc.
+    # readonly=True: được phép đọc từ replica
+    if has_app_context():
+        if readonly and _use_replica():
+            if 'db_replica' not in g:
+                g.db_replica = get_replicas().getconn()
+            if g.db_replica is not None:
+                return g.db_replica[1]
+        if 'db_conn' not in g:
+            g.db_conn = get_pool().getconn()
+        return g.db_conn
+    raise RuntimeError('get_db_connection() cần app context, hãy dùng db_connection()')
+
+
+@contextmanager
+def db_connection(readonly=False):
+    if has_app_context():
+        yield get_db_connection(readonly)
+        return
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+
+@contextmanager
+def transaction(sticky=True):
+    # sticky=False cho các ghi phụ (đếm lượt xem) không cần đọc lại ngay từ primary
+    with db_connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    if sticky:
+        _mark_written()
+
+
+def close_db_connection(exception=None):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().putconn(conn)
+    _release_replica()
+
+
+def execute_query(query, params=None, fetch=False):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        start = time.perf_counter()
+        try:
+            cur.execute(query, params or ())
+            metrics.observe_query('execute_query', time.perf_counter() - start, params or ())
+            if fetch:
+                result = cur.fetchall()
+            else:
+                result = cur.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+    return result
+
+
+def pool_stats():
+    pool = get_pool()
+    stats = pool.info()
+    stats.update(pool.stats.snapshot())
+    replicas = get_replicas()
+    if replicas:
+        stats.update(replicas.stats())
+    return stats
+
+
+def init_app(app):
+    app.teardown_appcontext(close_db_connection)
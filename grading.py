@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import repository
+import sandbox
+
+# Định dạng test trong form admin:
+#   dữ liệu vào (có thể nhiều dòng)
+#   =>
+#   kết quả mong đợi
+#   ---
+#   test tiếp theo ...
+CASE_SEPARATOR = '---'
+OUTPUT_MARKER = '=>'
+
+# Chấm hàng loạt được chờ lâu hơn request thường để lấy slot worker
+BATCH_WAIT = 600
+
+
+def parse_test_cases(text):
+    cases = []
+    for block in (text or '').replace('\r\n', '\n').split('\n%s\n' % CASE_SEPARATOR):
+        if not block.strip():
+            continue
+        lines = block.strip('\n').split('\n')
+        if OUTPUT_MARKER in lines:
+            index = lines.index(OUTPUT_MARKER)
+            input_text = '\n'.join(lines[:index])
+            expected = '\n'.join(lines[index + 1:])
+        else:
+            input_text, expected = '', '\n'.join(lines)
+        cases.append((input_text + '\n' if input_text else '', expected))
+    return cases
+
+
+def format_test_cases(cases):
+    blocks = []
+    for input_text, expected in cases:
+        if input_text:
+            blocks.append('%s\n%s\n%s' % (input_text.rstrip('\n'), OUTPUT_MARKER, expected))
+        else:
+            blocks.append(expected)
+    return ('\n%s\n' % CASE_SEPARATOR).join(blocks)
+
+
+def _job_cases(lesson_id):
+    return [{'input': input_text, 'expected': expected}
+            for input_text, expected in repository.get_test_cases(lesson_id)]
+
+
+def grade_submission(lesson_id, code):
+    cases = _job_cases(lesson_id)
+    if not cases:
+        return None
+    return sandbox.grade(code, cases)
+
+
+def valid_submissions(submissions):
+    return isinstance(submissions, list) and all(
+        isinstance(submission, dict) and isinstance(submission.get('code'), str) for submission in submissions)
+
+
+def grade_batch(lesson_id, submissions):
+    # submissions: [{'id': ..., 'code': ...}]; bài nộp trùng code chỉ chấm một lần
+    cases = _job_cases(lesson_id)
+    if not cases:
+        return None
+    start = time.perf_counter()
+    unique = {}
+    for submission in submissions:
+        unique.setdefault(sandbox.code_key(submission['code']), submission['code'])
+    executor = sandbox.get_executor()
+    with ThreadPoolExecutor(max_workers=executor.workers) as pool:
+        futures = {key: pool.submit(executor.grade, code, cases, BATCH_WAIT) for key, code in unique.items()}
+        try:
+            graded = {key: future.result() for key, future in futures.items()}
+        except sandbox.ExecutorBusy:
+            # Hết chỗ chờ: bỏ các bài chưa chấm, route trả 429 để client gửi lại cả lô
+            for future in futures.values():
+                future.cancel()
+            raise
+    results = [dict(graded[sandbox.code_key(submission['code'])], id=submission.get('id'))
+               for submission in submissions]
+    return {
+        'results': results,
+        'submissions': len(submissions),
+        'graded': len(unique),
+        'passed': sum(1 for result in results if result['success']),
+        'time_ms': round((time.perf_counter() - start) * 1000, 1),
+    }
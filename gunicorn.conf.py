@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+
+# Chạy: gunicorn -c gunicorn.conf.py wsgi:app
+bind = '0.0.0.0:%s' % os.environ.get('PORT', 5000)
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Mỗi worker nhiều thread: phần lớn thời gian request là chờ database, sandbox và API chat
+worker_class = 'gthread'
+# Mỗi kết nối live (SSE) giữ một thread suốt thời gian mở (tối đa LIVE_MAX_SECONDS rồi trình duyệt tự nối lại).
+# ADMISSION_LIVE là số kết nối live tối đa mỗi worker; số thread đó được cộng thêm vào GUNICORN_THREADS
+# để stream đang mở không chiếm thread của request thường. Worker = ADMISSION_LIVE + GUNICORN_THREADS thread.
+live_streams = int(os.environ.setdefault('ADMISSION_LIVE', '32'))
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) + live_streams
+
+# Import app một lần ở master rồi fork: khởi động nhanh, chia sẻ bộ nhớ code.
+# Pool database, sandbox, client AI và job worker đều tự tạo lại theo pid sau khi fork.
+# Khi preload, HUP chỉ khởi động lại worker với code cũ; cập nhật code không gián đoạn
+# bằng USR2 (master mới) rồi WINCH + QUIT master cũ.
+preload_app = True
+
+# Triển khai sau một reverse proxy: tin X-Forwarded-For của đúng một proxy đó (xem TRUSTED_PROXIES trong main.py)
+os.environ.setdefault('TRUSTED_PROXIES', '1')
+
+# Giữ kết nối keep-alive ngắn với proxy phía trước (nginx/load balancer giữ lâu hơn con số này)
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# Thay worker định kỳ để tránh rò rỉ bộ nhớ tích lũy; jitter để các worker không cùng lúc khởi động lại
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def on_starting(server):
+    # Migration và tạo admin chỉ chạy ở master, trước khi fork worker.
+    # Nhiều máy cùng khởi động vẫn an toàn vì migration giữ khóa; đặt SKIP_MIGRATIONS=1 nếu đã chạy riêng.
+    if os.environ.get('SKIP_MIGRATIONS') == '1':
+        return
+    import db
+    import main
+    main.setup()
+    # Không để worker kế thừa kết nối database đã mở trong master
+    db.close_pool()
@@ -0,0 +1,180 @@
+import datetime
+import json
+import os
+import threading
+import traceback
+import page_cache
+import repository
+
+# Job lưu trong bảng jobs; mỗi process web có một thread worker nhận job bằng UPDATE có điều kiện
+JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 50))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 5))
+# Job "running" không cập nhật tiến độ quá lâu coi như worker đã chết, cho worker khác nhận lại
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 300))
+
+MODERATION_ACTIONS = ('approve', 'reject', 'delete')
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+class Job:
+    def __init__(self, row):
+        self.id = row[0]
+        self.kind = row[1]
+        self.payload = json.loads(row[2] or '{}')
+        self.total = row[4]
+        self.done = row[5]
+
+    def progress(self, done, total=None):
+        if total is not None:
+            self.total = total
+        self.done = done
+        repository.update_job_progress(self.id, self.total, self.done)
+
+
+@handler('moderate_lessons')
+def moderate_lessons(job):
+    # payload: {'action': ..., 'ids': [...]} hoặc {'action': ..., 'all_pending': true}
+    action = job.payload['action']
+    if job.payload.get('all_pending'):
+        batches = _pending_batches()
+        total = repository.count_lessons('pending')
+    else:
+        ids = job.payload['ids']
+        batches = (ids[i:i + JOB_BATCH_SIZE] for i in range(0, len(ids), JOB_BATCH_SIZE))
+        total = len(ids)
+    done = 0
+    job.progress(done, total)
+    for batch in batches:
+        repository.moderate_lessons(batch, action)
+        page_cache.invalidate('lessons', *['lesson:%d' % lesson_id for lesson_id in batch])
+        done += len(batch)
+        job.progress(done, max(total, done))
+
+
+def _pending_batches():
+    after_id = 0
+    while True:
+        batch = repository.lesson_ids('pending', after_id, JOB_BATCH_SIZE)
+        if not batch:
+            return
+        yield batch
+        after_id = batch[-1]
+
+
+@handler('reindex_search')
+def reindex_search(job):
+    total = repository.count_lessons() + repository.count_questions()
+    done = 0
+    job.progress(done, total)
+    after_id = 0
+    while True:
+        batch = repository.lesson_ids(None, after_id, JOB_BATCH_SIZE)
+        if not batch:
+            break
+        repository.reindex_lessons(batch)
+        after_id = batch[-1]
+        done += len(batch)
+        job.progress(done, max(total, done))
+    after_id = 0
+    while True:
+        count, after_id = repository.reindex_questions(after_id, JOB_BATCH_SIZE)
+        if not count:
+            break
+        done += count
+        job.progress(done, max(total, done))
+
+
+@handler('clear_page_cache')
+def clear_page_cache(job):
+    page_cache.invalidate('all')
+    job.progress(1, 1)
+
+
+class Worker:
+    def __init__(self):
+        self.pid = os.getpid()
+        self._wake = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        threading.Thread(target=self._loop, daemon=True, name='job-worker').start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            try:
+                while self._run_one():
+                    pass
+            except Exception:
+                traceback.print_exc()
+            self._wake.wait(JOB_POLL_SECONDS)
+            self._wake.clear()
+
+    def _run_one(self):
+        stale_before = datetime.datetime.now() - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+        row = repository.claim_next_job(stale_before)
+        if row is None:
+            return False
+        job = Job(row)
+        try:
+            HANDLERS[job.kind](job)
+        except Exception as e:
+            self.failed += 1
+            repository.finish_job(job.id, 'failed', '%s: %s' % (type(e).__name__, e))
+        else:
+            self.processed += 1
+            repository.finish_job(job.id, 'done')
+        return True
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    # Tạo lại thread worker sau khi fork
+    global _worker
+    with _worker_lock:
+        if _worker is None or _worker.pid != os.getpid():
+            _worker = Worker()
+        return _worker
+
+
+def enqueue(kind, payload, created_by, total=0):
+    job_id = repository.create_job(kind, json.dumps(payload), total, created_by)
+    get_worker().wake()
+    return job_id
+
+
+def job_status(row):
+    return {
+        'id': row[0],
+        'kind': row[1],
+        'status': row[3],
+        'total': row[4],
+        'done': row[5],
+        'percent': round(row[5] * 100 / row[4]) if row[4] else (100 if row[3] == 'done' else 0),
+        'error': row[6],
+        'created_by': row[7],
+        'created_at': row[8].isoformat() if row[8] else None,
+        'started_at': row[9].isoformat() if row[9] else None,
+        'finished_at': row[10].isoformat() if row[10] else None,
+    }
+
+
+def _ensure_worker():
+    get_worker()
+
+
+def init_app(app):
+    # Worker của process này nhận cả các job còn sót từ lần chạy trước
+    app.before_request(_ensure_worker)
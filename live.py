@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from flask import Response
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Cập nhật trực tiếp cho trang hỏi đáp qua server-sent events.
+# Mặc định chỉ phát trong process; đặt LIVE_REDIS_URL để các worker/máy nhận sự kiện của nhau.
+LIVE_REDIS_URL = os.environ.get('LIVE_REDIS_URL')
+# Client đọc chậm để đầy hàng đợi thì bị ngắt, trình duyệt tải lại trang thay vì nhận thiếu
+LIVE_QUEUE_SIZE = int(os.environ.get('LIVE_QUEUE_SIZE', 100))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get('LIVE_HEARTBEAT_SECONDS', 15))
+# Đóng kết nối định kỳ để trả thread và để proxy/worker không giữ mãi;
+# EventSource tự nối lại sau LIVE_RETRY_MS kèm Last-Event-ID nên không mất sự kiện
+LIVE_MAX_SECONDS = float(os.environ.get('LIVE_MAX_SECONDS', 120))
+LIVE_RETRY_MS = int(os.environ.get('LIVE_RETRY_MS', 3000))
+# Số sự kiện tối đa gửi bù khi nối lại (lấy từ database theo Last-Event-ID)
+LIVE_BACKFILL = int(os.environ.get('LIVE_BACKFILL', 50))
+REDIS_PREFIX = 'live:'
+
+
+class Subscriber:
+    def __init__(self, channel):
+        self.channel = channel
+        self.queue = queue.Queue(LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class Bus:
+    def __init__(self):
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._channels = {}
+        self.published = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    def subscribe(self, channel):
+        subscriber = Subscriber(channel)
+        with self._lock:
+            self._channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._channels.get(subscriber.channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._channels[subscriber.channel]
+
+    def publish(self, channel, event):
+        self.published += 1
+        self._deliver(channel, event)
+
+    def _deliver(self, channel, event):
+        # Không bao giờ chặn người gửi: hàng đợi đầy thì đánh dấu client đó để ngắt
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(event)
+                self.delivered += 1
+            except queue.Full:
+                if not subscriber.overflowed:
+                    subscriber.overflowed = True
+                    self.overflows += 1
+
+    def stats(self):
+        with self._lock:
+            channels = len(self._channels)
+            clients = sum(len(subscribers) for subscribers in self._channels.values())
+        return {'backend': 'local', 'channels': channels, 'clients': clients, 'published': self.published,
+                'delivered': self.delivered, 'overflows': self.overflows}
+
+
+class RedisBus(Bus):
+    # Gửi qua Redis pub/sub; một thread mỗi process nhận mọi kênh live:* rồi phát cho client cục bộ
+    def __init__(self, url):
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        threading.Thread(target=self._listen, daemon=True, name='live-listener').start()
+
+    def publish(self, channel, event):
+        self.published += 1
+        try:
+            self.client.publish(REDIS_PREFIX + channel, json.dumps(event))
+        except Exception:
+            # Redis lỗi: ít nhất client trong process này vẫn nhận được
+            self._deliver(channel, event)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(REDIS_PREFIX + '*')
+                for message in pubsub.listen():
+                    channel = message['channel'].decode()[len(REDIS_PREFIX):]
+                    self._deliver(channel, json.loads(message['data']))
+            except Exception:
+                traceback.print_exc()
+                time.sleep(1)
+
+    def stats(self):
+        stats = super().stats()
+        stats['backend'] = 'redis'
+        return stats
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    # Tạo lại sau khi fork (thread nhận Redis không đi theo process con)
+    global _bus
+    with _bus_lock:
+        if _bus is None or _bus.pid != os.getpid():
+            if LIVE_REDIS_URL and redis:
+                _bus = RedisBus(LIVE_REDIS_URL)
+            else:
+                _bus = Bus()
+        return _bus
+
+
+def publish(channel, kind, data):
+    # data['id'] (nếu có) thành id của sự kiện SSE, dùng để nối lại không mất/trùng
+    get_bus().publish(channel, dict(data, type=kind))
+
+
+def _format(event):
+    lines = []
+    if event.get('id') is not None:
+        lines.append('id: %s' % event['id'])
+    lines.append('event: %s' % event['type'])
+    lines.append('data: %s' % json.dumps(event, ensure_ascii=False, default=str))
+    return '\n'.join(lines) + '\n\n'
+
+
+def stream(channel, last_id=None, backfill=None):
+    # backfill(last_id, limit): các sự kiện đã lỡ kể từ last_id, lấy từ database
+    bus = get_bus()
+    # Đăng ký trước khi gửi bù để không lỡ sự kiện xảy ra ở giữa
+    subscriber = bus.subscribe(channel)
+
+    def generate():
+        sent_id = last_id
+        try:
+            yield 'retry: %d\n\n' % LIVE_RETRY_MS
+            if last_id is not None and backfill is not None:
+                for event in backfill(last_id, LIVE_BACKFILL):
+                    sent_id = max(sent_id, event['id'])
+                    yield _format(event)
+            deadline = time.monotonic() + LIVE_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event = subscriber.queue.get(timeout=LIVE_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment SSE giữ kết nối qua proxy và phát hiện client đã đóng tab
+                    yield ': ping\n\n'
+                    continue
+                if subscriber.overflowed:
+                    yield 'event: reload\ndata: {}\n\n'
+                    return
+                if event.get('id') is not None and sent_id is not None and event['id'] <= sent_id:
+                    continue
+                if event.get('id') is not None:
+                    sent_id = event['id']
+                yield _format(event)
+        finally:
+            bus.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def live_stats():
+    if _bus is None or _bus.pid != os.getpid():
+        return {}
+    return _bus.stats()
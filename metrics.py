@@ -0,0 +1,182 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+from flask import Response, g, request, session, template_rendered, before_render_template
+
+# Ngưỡng ghi log (ms) cho truy vấn và request chậm
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+# Cho phép ?_profile=1 với mọi người dùng (chỉ bật khi debug), mặc định chỉ admin
+PROFILE_ALL = os.environ.get('PROFILE_ALL') == '1'
+PROFILE_LINES = int(os.environ.get('PROFILE_LINES', 40))
+# Prometheus không có session admin: gửi "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger('metrics')
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            items = sorted(self._series.items())
+            for label_values, (counts, total, count) in items:
+                labels = _labels(zip(self.labels, label_values))
+                for bound, bucket_count in zip(BUCKETS, counts):
+                    lines.append('%s_bucket{%sle="%s"} %d' % (self.name, labels + ',' if labels else '', bound, bucket_count))
+                lines.append('%s_bucket{%sle="+Inf"} %d' % (self.name, labels + ',' if labels else '', count))
+                lines.append('%s_sum{%s} %.6f' % (self.name, labels, total))
+                lines.append('%s_count{%s} %d' % (self.name, labels, count))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+
+REQUEST_SECONDS = Histogram('app_request_duration_seconds', 'Thời gian xử lý request theo route',
+                            ('endpoint', 'method', 'status'))
+TEMPLATE_SECONDS = Histogram('app_template_render_seconds', 'Thời gian render template', ('template',))
+QUERY_SECONDS = Histogram('app_db_query_duration_seconds', 'Thời gian chạy câu SQL theo tên statement', ('statement',))
+UPSTREAM_SECONDS = Histogram('app_upstream_duration_seconds', 'Thời gian gọi dịch vụ ngoài', ('service', 'phase'))
+HISTOGRAMS = (REQUEST_SECONDS, TEMPLATE_SECONDS, QUERY_SECONDS, UPSTREAM_SECONDS)
+
+
+def observe_query(name, elapsed, params=()):
+    QUERY_SECONDS.observe(elapsed, name)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning('slow query %s: %.1f ms (%d params)', name, elapsed * 1000, len(params))
+
+
+def observe_upstream(service, phase, elapsed):
+    UPSTREAM_SECONDS.observe(elapsed, service, phase)
+
+
+def _gauges():
+    # Số liệu tức thời của các thành phần khác, đọc lúc Prometheus scrape
+    import ai_client
+    import db
+    import live
+    import page_cache
+    import progress
+    import rate_limit
+    import sandbox
+
+    gauges = []
+    for key, value in db.pool_stats().items():
+        if isinstance(value, (int, float)):
+            gauges.append(('app_db_pool_%s' % key, (), value))
+    executor = sandbox.executor_stats(start=False)
+    if executor:
+        for key in ('workers', 'idle', 'running', 'queued', 'sessions', 'session_workers', 'queue_size',
+                    'completed', 'rejected', 'timeouts', 'killed'):
+            gauges.append(('app_executor_%s' % key, (), executor[key]))
+    for key, value in page_cache.page_cache_stats().items():
+        if isinstance(value, (int, float)):
+            gauges.append(('app_page_cache_%s' % key, (), value))
+    ai = ai_client.ai_stats()
+    for source, value in ai['requests'].items():
+        gauges.append(('app_ai_requests', (('source', source),), value))
+    gauges.append(('app_ai_breaker_open', (), 0 if ai['breaker']['state'] == 'closed' else 1))
+    for key, value in progress.progress_stats().items():
+        gauges.append(('app_progress_%s' % key, (), value))
+    for key, value in live.live_stats().items():
+        if isinstance(value, (int, float)):
+            gauges.append(('app_live_%s' % key, (), value))
+    for name, values in rate_limit.rate_limit_stats().items():
+        for key in ('allowed', 'limited', 'shed', 'in_flight'):
+            gauges.append(('app_rate_limit_%s' % key, (('group', name),), values[key]))
+    return gauges
+
+
+def render():
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    seen = set()
+    for name, labels, value in _gauges():
+        if name not in seen:
+            seen.add(name)
+            lines.append('# TYPE %s gauge' % name)
+        lines.append('%s{%s} %s' % (name, _labels(labels), value) if labels else '%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def authorized():
+    if session.get('username') == 'admin':
+        return True
+    header = request.headers.get('Authorization', '')
+    return bool(METRICS_TOKEN) and header == 'Bearer %s' % METRICS_TOKEN
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    if request.args.get('_profile') and (PROFILE_ALL or session.get('username') == 'admin'):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # Trả về kết quả cProfile thay cho trang, sắp theo thời gian cộng dồn
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return Response(output.getvalue(), mimetype='text/plain')
+    start = g.pop('metrics_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed, request.endpoint or 'unknown', request.method, response.status_code)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            logger.warning('slow request %s %s: %.1f ms', request.method, request.path, elapsed * 1000)
+    return response
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - starts.pop(), template.name or 'string')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+
+def metrics_response():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
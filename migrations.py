@@ -0,0 +1,304 @@
+import datetime
+from db import USE_POSTGRES, db_connection
+from repository import fold_text
+
+# Khóa advisory của Postgres, tránh nhiều worker chạy migration cùng lúc
+MIGRATION_LOCK_ID = 727001
+
+P = '%s' if USE_POSTGRES else '?'
+
+
+def _rebuild_sqlite(table, columns, select):
+    # SQLite không đổi được kiểu cột: tạo bảng mới, chép dữ liệu, đổi tên
+    return [
+        'CREATE TABLE %s_new (%s)' % (table, columns),
+        'INSERT INTO %s_new SELECT %s FROM %s' % (table, select, table),
+        'DROP TABLE %s' % table,
+        'ALTER TABLE %s_new RENAME TO %s' % (table, table),
+    ]
+
+
+def _backfill_search(cur):
+    # Đưa dữ liệu có sẵn vào chỉ mục tìm kiếm (chỉ bài học đã duyệt)
+    insert = 'INSERT INTO search_documents (kind, ref_id, title, body) VALUES (%s, %s, %s, %s)' % (P, P, P, P)
+    cur.execute("SELECT id, title, content, code_example FROM lessons WHERE status = 'approved'")
+    for lesson_id, title, content, code_example in cur.fetchall():
+        cur.execute(insert, ('lesson', lesson_id, fold_text(title), fold_text(content, code_example)))
+    cur.execute('SELECT id, title, content FROM questions')
+    questions = cur.fetchall()
+    for question_id, title, content in questions:
+        cur.execute('SELECT content FROM answers WHERE question_id = %s ORDER BY created_at' % P, (question_id,))
+        answers = [row[0] for row in cur.fetchall()]
+        cur.execute(insert, ('question', question_id, fold_text(title), fold_text(content, *answers)))
+
+
+# (version, name, các câu lệnh SQLite, các câu lệnh Postgres); bước có thể là hàm nhận cursor
+MIGRATIONS = [
+    (1, 'initial_schema', [
+        '''CREATE TABLE IF NOT EXISTS users
+           (id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, created_at TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS questions
+           (id INTEGER PRIMARY KEY, title TEXT, content TEXT, author TEXT, created_at TEXT, answers INTEGER DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS answers
+           (id INTEGER PRIMARY KEY, question_id INTEGER, content TEXT, author TEXT, created_at TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS lessons
+           (id INTEGER PRIMARY KEY, title TEXT, content TEXT, code_example TEXT,
+            exercise TEXT, video_url TEXT, author TEXT, created_at TEXT,
+            status TEXT DEFAULT 'approved', type TEXT DEFAULT 'course')''',
+        '''CREATE TABLE IF NOT EXISTS solutions
+           (id INTEGER PRIMARY KEY, lesson_id INTEGER, solution_code TEXT, explanation TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS contacts
+           (id INTEGER PRIMARY KEY, username TEXT, subject TEXT, message TEXT, created_at TEXT)''',
+    ], [
+        '''CREATE TABLE IF NOT EXISTS users
+           (id SERIAL PRIMARY KEY, username VARCHAR(255) UNIQUE, password VARCHAR(255), created_at TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS questions
+           (id SERIAL PRIMARY KEY, title TEXT, content TEXT, author VARCHAR(255), created_at TIMESTAMP, answers INTEGER DEFAULT 0)''',
+        '''CREATE TABLE IF NOT EXISTS answers
+           (id SERIAL PRIMARY KEY, question_id INTEGER, content TEXT, author VARCHAR(255), created_at TIMESTAMP)''',
+        '''CREATE TABLE IF NOT EXISTS lessons
+           (id SERIAL PRIMARY KEY, title TEXT, content TEXT, code_example TEXT,
+            exercise TEXT, video_url TEXT, author VARCHAR(255), created_at TIMESTAMP,
+            status VARCHAR(50) DEFAULT 'approved', type VARCHAR(50) DEFAULT 'course')''',
+        '''CREATE TABLE IF NOT EXISTS solutions
+           (id SERIAL PRIMARY KEY, lesson_id INTEGER, solution_code TEXT, explanation TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS contacts
+           (id SERIAL PRIMARY KEY, username VARCHAR(255), subject TEXT, message TEXT, created_at TIMESTAMP)''',
+    ]),
+
+    # Cột created_at kiểu TIMESTAMP (Postgres đã dùng TIMESTAMP từ đầu)
+    (2, 'timestamp_columns',
+     _rebuild_sqlite('users', 'id INTEGER PRIMARY KEY, username TEXT UNIQUE, password TEXT, created_at TIMESTAMP',
+                     "id, username, password, replace(created_at, 'T', ' ')") +
+     _rebuild_sqlite('questions', 'id INTEGER PRIMARY KEY, title TEXT, content TEXT, author TEXT, '
+                                  'created_at TIMESTAMP, answers INTEGER DEFAULT 0',
+                     "id, title, content, author, replace(created_at, 'T', ' '), answers") +
+     _rebuild_sqlite('answers', 'id INTEGER PRIMARY KEY, question_id INTEGER, content TEXT, author TEXT, created_at TIMESTAMP',
+                     "id, question_id, content, author, replace(created_at, 'T', ' ')") +
+     _rebuild_sqlite('lessons', 'id INTEGER PRIMARY KEY, title TEXT, content TEXT, code_example TEXT, '
+                                'exercise TEXT, video_url TEXT, author TEXT, created_at TIMESTAMP, '
+                                "status TEXT DEFAULT 'approved', type TEXT DEFAULT 'course'",
+                     "id, title, content, code_example, exercise, video_url, author, "
+                     "replace(created_at, 'T', ' '), status, type") +
+     _rebuild_sqlite('contacts', 'id INTEGER PRIMARY KEY, username TEXT, subject TEXT, message TEXT, created_at TIMESTAMP',
+                     "id, username, subject, message, replace(created_at, 'T', ' ')"),
+     []),
+
+    (3, 'list_indexes', [
+        'CREATE INDEX IF NOT EXISTS idx_lessons_status_created ON lessons (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_questions_created ON questions (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_answers_question_created ON answers (question_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_solutions_lesson ON solutions (lesson_id)',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_created ON contacts (created_at)',
+    ], [
+        'CREATE INDEX IF NOT EXISTS idx_lessons_status_created ON lessons (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_questions_created ON questions (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_answers_question_created ON answers (question_id, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_solutions_lesson ON solutions (lesson_id)',
+        'CREATE INDEX IF NOT EXISTS idx_contacts_created ON contacts (created_at)',
+    ]),
+
+    # Phân trang keyset sắp xếp theo (created_at, id)
+    (4, 'keyset_indexes', [
+        'DROP INDEX IF EXISTS idx_lessons_status_created',
+        'DROP INDEX IF EXISTS idx_questions_created',
+        'CREATE INDEX IF NOT EXISTS idx_lessons_status_created_id ON lessons (status, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_questions_created_id ON questions (created_at, id)',
+    ], [
+        'DROP INDEX IF EXISTS idx_lessons_status_created',
+        'DROP INDEX IF EXISTS idx_questions_created',
+        'CREATE INDEX IF NOT EXISTS idx_lessons_status_created_id ON lessons (status, created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_questions_created_id ON questions (created_at, id)',
+    ]),
+
+    # Test chấm bài tự động, lưu cùng lời giải của bài học
+    (5, 'test_cases', [
+        '''CREATE TABLE IF NOT EXISTS test_cases
+           (id INTEGER PRIMARY KEY, lesson_id INTEGER, position INTEGER, input TEXT, expected_output TEXT)''',
+        'CREATE INDEX IF NOT EXISTS idx_test_cases_lesson ON test_cases (lesson_id, position)',
+    ], [
+        '''CREATE TABLE IF NOT EXISTS test_cases
+           (id SERIAL PRIMARY KEY, lesson_id INTEGER, position INTEGER, input TEXT, expected_output TEXT)''',
+        'CREATE INDEX IF NOT EXISTS idx_test_cases_lesson ON test_cases (lesson_id, position)',
+    ]),
+
+    # Tìm kiếm toàn văn: search_documents lưu văn bản đã bỏ dấu, chỉ mục FTS5 / tsvector đi kèm
+    (6, 'search_index', [
+        '''CREATE TABLE IF NOT EXISTS search_documents
+           (id INTEGER PRIMARY KEY, kind TEXT, ref_id INTEGER, title TEXT, body TEXT)''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_search_documents_ref ON search_documents (kind, ref_id)',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5
+           (title, body, content='search_documents', content_rowid='id', tokenize='unicode61 remove_diacritics 2')''',
+        '''CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+             INSERT INTO search_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+             INSERT INTO search_fts (search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+             INSERT INTO search_fts (search_fts, rowid, title, body) VALUES ('delete', old.id, old.title, old.body);
+             INSERT INTO search_fts (rowid, title, body) VALUES (new.id, new.title, new.body);
+           END''',
+        _backfill_search,
+    ], [
+        '''CREATE TABLE IF NOT EXISTS search_documents
+           (id SERIAL PRIMARY KEY, kind VARCHAR(20), ref_id INTEGER, title TEXT, body TEXT,
+            document tsvector GENERATED ALWAYS AS
+              (setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+               setweight(to_tsvector('simple', coalesce(body, '')), 'B')) STORED)''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_search_documents_ref ON search_documents (kind, ref_id)',
+        'CREATE INDEX IF NOT EXISTS idx_search_documents_document ON search_documents USING GIN (document)',
+        _backfill_search,
+    ]),
+
+    # Hỏi đáp: khóa ngoại xóa dây chuyền, bộ đếm lượt xem và thời điểm hoạt động cuối.
+    # Số câu trả lời được tính lại từ bảng answers để sửa các bộ đếm đã lệch.
+    (7, 'qa_counters', [
+        'DELETE FROM answers WHERE question_id IS NULL OR question_id NOT IN (SELECT id FROM questions)',
+    ] + _rebuild_sqlite('questions', 'id INTEGER PRIMARY KEY, title TEXT, content TEXT, author TEXT, '
+                                     'created_at TIMESTAMP, answers INTEGER DEFAULT 0, '
+                                     'views INTEGER DEFAULT 0, last_activity_at TIMESTAMP',
+                        'id, title, content, author, created_at, '
+                        '(SELECT count(*) FROM answers a WHERE a.question_id = questions.id), 0, '
+                        'coalesce((SELECT max(a.created_at) FROM answers a WHERE a.question_id = questions.id), created_at)') +
+    _rebuild_sqlite('answers', 'id INTEGER PRIMARY KEY, '
+                               'question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE, '
+                               'content TEXT, author TEXT, created_at TIMESTAMP',
+                    'id, question_id, content, author, created_at') + [
+        'CREATE INDEX IF NOT EXISTS idx_questions_created_id ON questions (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_questions_activity_id ON questions (last_activity_at, id)',
+        'CREATE INDEX IF NOT EXISTS idx_answers_question_created ON answers (question_id, created_at)',
+    ], [
+        'DELETE FROM answers WHERE question_id IS NULL OR question_id NOT IN (SELECT id FROM questions)',
+        'ALTER TABLE questions ADD COLUMN IF NOT EXISTS views INTEGER DEFAULT 0',
+        'ALTER TABLE questions ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP',
+        '''UPDATE questions SET
+             answers = (SELECT count(*) FROM answers a WHERE a.question_id = questions.id),
+             views = 0,
+             last_activity_at = coalesce((SELECT max(a.created_at) FROM answers a WHERE a.question_id = questions.id),
+                                         created_at)''',
+        'ALTER TABLE answers ALTER COLUMN question_id SET NOT NULL',
+        'ALTER TABLE answers ADD CONSTRAINT answers_question_id_fkey '
+        'FOREIGN KEY (question_id) REFERENCES questions (id) ON DELETE CASCADE',
+        'CREATE INDEX IF NOT EXISTS idx_questions_activity_id ON questions (last_activity_at, id)',
+    ]),
+
+    # Hàng đợi job chạy nền (duyệt hàng loạt, đánh chỉ mục lại, xóa cache)
+    (8, 'jobs', [
+        '''CREATE TABLE IF NOT EXISTS jobs
+           (id INTEGER PRIMARY KEY, kind TEXT, payload TEXT, status TEXT DEFAULT 'queued',
+            total INTEGER DEFAULT 0, done INTEGER DEFAULT 0, error TEXT, created_by TEXT,
+            created_at TIMESTAMP, started_at TIMESTAMP, heartbeat_at TIMESTAMP, finished_at TIMESTAMP)''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status_id ON jobs (status, id)',
+    ], [
+        '''CREATE TABLE IF NOT EXISTS jobs
+           (id SERIAL PRIMARY KEY, kind VARCHAR(50), payload TEXT, status VARCHAR(20) DEFAULT 'queued',
+            total INTEGER DEFAULT 0, done INTEGER DEFAULT 0, error TEXT, created_by VARCHAR(255),
+            created_at TIMESTAMP, started_at TIMESTAMP, heartbeat_at TIMESTAMP, finished_at TIMESTAMP)''',
+        'CREATE INDEX IF NOT EXISTS idx_jobs_status_id ON jobs (status, id)',
+    ]),
+
+    # Tiến độ học: bảng tổng hợp theo (người dùng, bài học) và theo người dùng, cộng dồn khi flush
+    (9, 'learner_progress', [
+        '''CREATE TABLE IF NOT EXISTS lesson_progress
+           (username TEXT NOT NULL, lesson_id INTEGER NOT NULL, views INTEGER DEFAULT 0,
+            exercise_views INTEGER DEFAULT 0, runs INTEGER DEFAULT 0, submissions INTEGER DEFAULT 0,
+            passed INTEGER DEFAULT 0, first_seen_at TIMESTAMP, last_seen_at TIMESTAMP, passed_at TIMESTAMP,
+            PRIMARY KEY (username, lesson_id))''',
+        'CREATE INDEX IF NOT EXISTS idx_lesson_progress_user_seen ON lesson_progress (username, last_seen_at)',
+        '''CREATE TABLE IF NOT EXISTS user_progress
+           (username TEXT PRIMARY KEY, views INTEGER DEFAULT 0, runs INTEGER DEFAULT 0,
+            submissions INTEGER DEFAULT 0, last_active_at TIMESTAMP)''',
+    ], [
+        '''CREATE TABLE IF NOT EXISTS lesson_progress
+           (username VARCHAR(255) NOT NULL, lesson_id INTEGER NOT NULL, views INTEGER DEFAULT 0,
+            exercise_views INTEGER DEFAULT 0, runs INTEGER DEFAULT 0, submissions INTEGER DEFAULT 0,
+            passed INTEGER DEFAULT 0, first_seen_at TIMESTAMP, last_seen_at TIMESTAMP, passed_at TIMESTAMP,
+            PRIMARY KEY (username, lesson_id))''',
+        'CREATE INDEX IF NOT EXISTS idx_lesson_progress_user_seen ON lesson_progress (username, last_seen_at)',
+        '''CREATE TABLE IF NOT EXISTS user_progress
+           (username VARCHAR(255) PRIMARY KEY, views INTEGER DEFAULT 0, runs INTEGER DEFAULT 0,
+            submissions INTEGER DEFAULT 0, last_active_at TIMESTAMP)''',
+    ]),
+
+    # Bộ đếm phiên bản của tag page cache, dùng chung cho mọi process
+    (10, 'page_generations', [
+        'CREATE TABLE IF NOT EXISTS page_generations (tag TEXT PRIMARY KEY, generation INTEGER NOT NULL DEFAULT 0)',
+    ], [
+        'CREATE TABLE IF NOT EXISTS page_generations '
+        '(tag VARCHAR(255) PRIMARY KEY, generation INTEGER NOT NULL DEFAULT 0)',
+    ]),
+]
+
+
+def _applied_versions(conn):
+    cur = conn.cursor()
+    try:
+        cur.execute('SELECT version FROM schema_migrations')
+        versions = {row[0] for row in cur.fetchall()}
+        conn.commit()
+        return versions
+    except Exception:
+        conn.rollback()
+        cur.execute('CREATE TABLE IF NOT EXISTS schema_migrations '
+                    '(version INTEGER PRIMARY KEY, name TEXT, applied_at TIMESTAMP)')
+        conn.commit()
+        return set()
+
+
+def _apply(conn, version, name, steps):
+    cur = conn.cursor()
+    if not USE_POSTGRES:
+        cur.execute('PRAGMA foreign_keys = OFF')
+    try:
+        if USE_POSTGRES:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+        else:
+            cur.execute('BEGIN IMMEDIATE')
+        # Kiểm tra lại trong khóa: worker khác có thể vừa chạy xong
+        cur.execute('SELECT 1 FROM schema_migrations WHERE version = %s' % P, (version,))
+        if cur.fetchone() is not None:
+            conn.commit()
+            return False
+        for step in steps:
+            if callable(step):
+                step(cur)
+            else:
+                cur.execute(step)
+        cur.execute('INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)' % (P, P, P),
+                    (version, name, datetime.datetime.now()))
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if not USE_POSTGRES:
+            cur.execute('PRAGMA foreign_keys = ON')
+
+
+def migrate():
+    # Chỉ chạy các migration chưa áp dụng; khởi động lại không chạy DDL
+    applied = []
+    with db_connection() as conn:
+        done = _applied_versions(conn)
+        for version, name, sqlite_steps, postgres_steps in MIGRATIONS:
+            if version in done:
+                continue
+            if _apply(conn, version, name, postgres_steps if USE_POSTGRES else sqlite_steps):
+                applied.append(version)
+    return applied
+
+
+def pending_versions():
+    # Chỉ đọc, không tạo bảng: dùng cho kiểm tra readiness
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT version FROM schema_migrations')
+            done = {row[0] for row in cur.fetchall()}
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            done = set()
+    return [version for version, _, _, _ in MIGRATIONS if version not in done]
@@ -0,0 +1,169 @@
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from flask import make_response, request, session
+from cache import LRUCache
+import db
+import repository
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+PAGE_CACHE_MB = int(os.environ.get('PAGE_CACHE_MB', 32))
+PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL', 3600))
+# Backend cục bộ: phiên bản tag lưu trong database để xóa cache ở một worker có hiệu lực ở mọi worker;
+# mỗi process nhớ giá trị đã đọc trong ngần này giây (độ trễ tối đa giữa các worker)
+PAGE_CACHE_SYNC_SECONDS = float(os.environ.get('PAGE_CACHE_SYNC_SECONDS', 1))
+# Đặt PAGE_CACHE_REDIS_URL để các process dùng chung cache và bộ đếm phiên bản
+PAGE_CACHE_REDIS_URL = os.environ.get('PAGE_CACHE_REDIS_URL')
+
+
+class LocalBackend:
+    # Trang cache trong process; trang cũ không bị xóa mà tự hết chỗ theo LRU
+    def __init__(self):
+        self.pages = LRUCache(PAGE_CACHE_MB * 1024 * 1024, ttl=PAGE_CACHE_TTL)
+        self._lock = threading.Lock()
+        # tag -> (phiên bản, thời điểm đọc từ database)
+        self._generations = {}
+        self.syncs = 0
+
+    def generations(self, tags):
+        now = time.monotonic()
+        with self._lock:
+            known = {tag: self._generations.get(tag) for tag in tags}
+        stale = [tag for tag, item in known.items() if item is None or now - item[1] >= PAGE_CACHE_SYNC_SECONDS]
+        if stale:
+            fresh = {tag: (generation, now) for tag, generation in zip(stale, repository.get_page_generations(stale))}
+            known.update(fresh)
+            with self._lock:
+                self._generations.update(fresh)
+                self.syncs += 1
+        return [known[tag][0] for tag in tags]
+
+    def bump(self, tags):
+        repository.bump_page_generations(tags)
+        # Process này đọc lại ngay ở request sau, các process khác sau tối đa PAGE_CACHE_SYNC_SECONDS
+        with self._lock:
+            for tag in tags:
+                self._generations.pop(tag, None)
+
+    def get(self, key):
+        return self.pages.get(key)
+
+    def set(self, key, entry):
+        self.pages.set(key, entry, len(entry['body']) + len(key))
+
+    def stats(self):
+        stats = self.pages.stats()
+        stats['backend'] = 'local'
+        stats['generation_syncs'] = self.syncs
+        return stats
+
+
+class RedisBackend:
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.hits = 0
+        self.misses = 0
+
+    def generations(self, tags):
+        values = self.client.mget(['page_gen:%s' % tag for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def bump(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr('page_gen:%s' % tag)
+        pipe.execute()
+
+    def get(self, key):
+        data = self.client.get('page:%s' % key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry = json.loads(data)
+        entry['body'] = entry['body'].encode()
+        return entry
+
+    def set(self, key, entry):
+        data = dict(entry, body=entry['body'].decode())
+        self.client.setex('page:%s' % key, PAGE_CACHE_TTL, json.dumps(data))
+
+    def stats(self):
+        return {'backend': 'redis', 'hits': self.hits, 'misses': self.misses}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if PAGE_CACHE_REDIS_URL and redis:
+                _backend = RedisBackend(PAGE_CACHE_REDIS_URL)
+            else:
+                _backend = LocalBackend()
+        return _backend
+
+
+def invalidate(*tags):
+    # Gọi sau mỗi thao tác ghi: mọi trang gắn tag này sẽ được render lại
+    get_backend().bump(tags)
+
+
+def _cacheable():
+    # Trang có flash message chỉ hiện một lần, không được cache
+    return request.method == 'GET' and not session.get('_flashes')
+
+
+def cached(*tags):
+    # tags có thể chứa tham số của route, ví dụ 'lesson:{lesson_id}'
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if not _cacheable():
+                return view(**kwargs)
+            backend = get_backend()
+            # Tag 'all' có trên mọi trang để xóa toàn bộ cache khi cần
+            page_tags = ['all'] + [tag.format(**kwargs) for tag in tags]
+            # Trang phụ thuộc người xem (menu, nút admin) nên khóa gồm cả username
+            key = '%s|%s|%s|%s' % (request.endpoint, request.full_path, session.get('username', ''),
+                                   ','.join(map(str, backend.generations(page_tags))))
+            entry = backend.get(key)
+            if entry is None:
+                # Trang sẽ được cache cho mọi người: đọc từ primary để không lưu dữ liệu replica còn trễ
+                db.prefer_primary()
+                response = make_response(view(**kwargs))
+                if response.status_code != 200 or response.direct_passthrough or session.get('_flashes'):
+                    return response
+                body = response.get_data()
+                entry = {
+                    'body': body,
+                    'mimetype': response.mimetype,
+                    'etag': hashlib.sha1(body).hexdigest(),
+                    'last_modified': int(time.time()),
+                }
+                backend.set(key, entry)
+            else:
+                response = make_response(entry['body'])
+                response.mimetype = entry['mimetype']
+            response.set_etag(entry['etag'])
+            response.last_modified = entry['last_modified']
+            # Trình duyệt luôn hỏi lại, proxy dùng chung không được giữ trang theo cookie
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def page_cache_stats():
+    return get_backend().stats()
@@ -0,0 +1,86 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# scrypt chạy trong thread riêng và nhả GIL: đợt đăng nhập đầu giờ học chỉ chiếm
+# tối đa PASSWORD_HASH_WORKERS luồng băm, các request khác vẫn được phục vụ
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=KEY_BYTES)
+
+
+def _hash(password):
+    salt = secrets.token_bytes(SALT_BYTES)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return 'scrypt$%d$%d$%d$%s$%s' % (SCRYPT_N, SCRYPT_R, SCRYPT_P, _b64(salt), _b64(key))
+
+
+def _is_legacy(stored):
+    # Mật khẩu cũ: sha256 hex không có salt
+    return len(stored) == 64 and '$' not in stored
+
+
+def _verify(password, stored):
+    if _is_legacy(stored):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    try:
+        scheme, n, r, p, salt, key = stored.split('$')
+        if scheme != 'scrypt':
+            return False
+        expected = base64.b64decode(key)
+        return hmac.compare_digest(_scrypt(password, base64.b64decode(salt), int(n), int(r), int(p)), expected)
+    except (ValueError, TypeError):
+        return False
+
+
+# Dùng khi không có user để thời gian phản hồi không lộ tên đăng nhập có tồn tại hay không
+_DUMMY_HASH = None
+
+
+def hash_password(password):
+    return _pool().submit(_hash, password).result()
+
+
+def verify_password(password, stored):
+    global _DUMMY_HASH
+    if stored is None:
+        if _DUMMY_HASH is None:
+            _DUMMY_HASH = hash_password(secrets.token_hex(8))
+        _pool().submit(_verify, password, _DUMMY_HASH).result()
+        return False
+    return _pool().submit(_verify, password, stored).result()
+
+
+def needs_rehash(stored):
+    # Hash sha256 cũ hoặc tham số scrypt đã đổi thì băm lại khi đăng nhập thành công
+    if _is_legacy(stored):
+        return True
+    return not stored.startswith('scrypt$%d$%d$%d$' % (SCRYPT_N, SCRYPT_R, SCRYPT_P))
@@ -0,0 +1,167 @@
+import atexit
+import datetime
+import functools
+import os
+import threading
+import traceback
+from flask import make_response, session
+import repository
+
+# Sự kiện học được gom trong bộ nhớ theo (người dùng, bài học) và ghi theo lô trên thread nền:
+# request chỉ cộng số đếm trong dict, không ghi database
+PROGRESS_FLUSH_SECONDS = float(os.environ.get('PROGRESS_FLUSH_SECONDS', 5))
+# Flush sớm khi số khóa đang chờ vượt ngưỡng này
+PROGRESS_FLUSH_KEYS = int(os.environ.get('PROGRESS_FLUSH_KEYS', 1000))
+# Database chậm/lỗi lâu: quá ngưỡng này thì bỏ sự kiện mới thay vì để bộ nhớ tăng mãi
+PROGRESS_MAX_KEYS = int(os.environ.get('PROGRESS_MAX_KEYS', 50000))
+
+# Vị trí số đếm trong bản ghi gom của từng (username, lesson_id)
+KINDS = ('view', 'exercise', 'run', 'submit')
+
+
+class Recorder:
+    def __init__(self):
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._lessons = {}
+        self._users = {}
+        self.recorded = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed = 0
+        threading.Thread(target=self._loop, daemon=True, name='progress-flush').start()
+
+    def record(self, username, lesson_id, kind, passed=False):
+        now = datetime.datetime.now()
+        index = KINDS.index(kind)
+        with self._lock:
+            if lesson_id is not None and (username, lesson_id) not in self._lessons \
+                    and len(self._lessons) >= PROGRESS_MAX_KEYS:
+                self.dropped += 1
+                return
+            self.recorded += 1
+            user = self._users.get(username)
+            if user is None:
+                user = self._users[username] = [0, 0, 0, 0, now]
+            user[index] += 1
+            user[4] = now
+            if lesson_id is not None:
+                entry = self._lessons.get((username, lesson_id))
+                if entry is None:
+                    # views, exercise_views, runs, submissions, passed, first_seen, last_seen, passed_at
+                    entry = self._lessons[(username, lesson_id)] = [0, 0, 0, 0, 0, now, now, None]
+                entry[index] += 1
+                entry[6] = now
+                if passed and not entry[4]:
+                    entry[4] = 1
+                    entry[7] = now
+            pending = len(self._lessons)
+        if pending >= PROGRESS_FLUSH_KEYS:
+            self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(PROGRESS_FLUSH_SECONDS)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                traceback.print_exc()
+
+    def flush(self):
+        # Đổi sang dict mới rồi ghi dict cũ ngoài khóa; ghi lỗi thì gộp trả lại để lần sau ghi tiếp
+        with self._flush_lock:
+            with self._lock:
+                lessons, self._lessons = self._lessons, {}
+                users, self._users = self._users, {}
+            if not lessons and not users:
+                return 0
+            lesson_rows = [key + tuple(entry) for key, entry in lessons.items()]
+            user_rows = [(username, entry[0] + entry[1], entry[2], entry[3], entry[4])
+                         for username, entry in users.items()]
+            try:
+                repository.record_progress(lesson_rows, user_rows)
+            except Exception:
+                self.failed += 1
+                self._restore(lessons, users)
+                raise
+            self.flushes += 1
+            return len(lesson_rows)
+
+    def _restore(self, lessons, users):
+        with self._lock:
+            for key, old in lessons.items():
+                entry = self._lessons.get(key)
+                if entry is None:
+                    self._lessons[key] = old
+                    continue
+                for i in range(4):
+                    entry[i] += old[i]
+                if old[4] and not entry[4]:
+                    entry[4], entry[7] = 1, old[7]
+                entry[5] = min(entry[5], old[5])
+            for username, old in users.items():
+                entry = self._users.get(username)
+                if entry is None:
+                    self._users[username] = old
+                    continue
+                for i in range(4):
+                    entry[i] += old[i]
+
+    def stats(self):
+        with self._lock:
+            return {'pending_lessons': len(self._lessons), 'pending_users': len(self._users),
+                    'recorded': self.recorded, 'dropped': self.dropped, 'flushes': self.flushes,
+                    'failed': self.failed}
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_recorder():
+    # Tạo lại thread flush sau khi fork
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None or _recorder.pid != os.getpid():
+            _recorder = Recorder()
+        return _recorder
+
+
+def record(kind, lesson_id=None, passed=False):
+    # Khách chưa đăng nhập không được ghi nhận
+    username = session.get('username')
+    if username:
+        get_recorder().record(username, lesson_id, kind, passed)
+
+
+def tracked(kind):
+    # Đặt trên @page_cache.cached để trang lấy từ cache vẫn được ghi nhận
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            response = make_response(view(**kwargs))
+            # Chỉ ghi khi trang thật sự được hiển thị (bài không tồn tại thì view chuyển hướng)
+            if response.status_code in (200, 304):
+                record(kind, kwargs.get('lesson_id'))
+            return response
+        return wrapper
+    return decorator
+
+
+def flush():
+    if _recorder is not None and _recorder.pid == os.getpid():
+        return _recorder.flush()
+    return 0
+
+
+def progress_stats():
+    if _recorder is None or _recorder.pid != os.getpid():
+        return {}
+    return _recorder.stats()
+
+
+# Tắt process thì ghi nốt phần còn trong bộ nhớ
+atexit.register(flush)
@@ -0,0 +1,193 @@
+import functools
+import math
+import os
+import threading
+import time
+from flask import Response, jsonify, request, session
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Hạn mức dạng "số request/giây": bucket chứa tối đa N token, hồi đầy sau đúng chu kỳ
+RATE_LIMITS = {
+    'run_code': os.environ.get('RATE_LIMIT_RUN_CODE', '30/60'),
+    'chat': os.environ.get('RATE_LIMIT_CHAT', '20/60'),
+    'live': os.environ.get('RATE_LIMIT_LIVE', '30/60'),
+}
+# Số request cùng lúc tối đa của mỗi nhóm trong một process, vượt quá thì từ chối ngay
+MAX_IN_FLIGHT = {
+    'run_code': int(os.environ.get('ADMISSION_RUN_CODE', 16)),
+    'chat': int(os.environ.get('ADMISSION_CHAT', 8)),
+    # Mỗi kết nối SSE giữ một thread suốt thời gian mở
+    'live': int(os.environ.get('ADMISSION_LIVE', 64)),
+}
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+LOCAL_MAX_KEYS = 10000
+
+RATE_LIMITED_MESSAGE = 'Bạn gửi quá nhiều yêu cầu, vui lòng thử lại sau ít phút!'
+OVERLOADED_MESSAGE = 'Máy chủ đang quá tải, vui lòng thử lại sau!'
+
+
+def _parse(limit):
+    capacity, period = limit.split('/')
+    return int(capacity), int(capacity) / float(period)
+
+
+class LocalBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, rate):
+        # Trả về 0 nếu được phép, ngược lại số giây phải chờ
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                wait = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(self._buckets) > LOCAL_MAX_KEYS:
+                self._prune(now, capacity, rate)
+        return wait
+
+    def _prune(self, now, capacity, rate):
+        # Bỏ các bucket đã hồi đầy: giữ lại cũng như tạo mới
+        for key, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * rate >= capacity:
+                del self._buckets[key]
+
+
+class RedisBackend:
+    # Token bucket nguyên tử bằng Lua, dùng chung giữa các process
+    SCRIPT = '''
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+        local tokens = tonumber(bucket[1]) or capacity
+        local last = tonumber(bucket[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+        return tostring(wait)
+    '''
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate):
+        return float(self.script(keys=['rate:%s' % key], args=[capacity, rate, time.time()]))
+
+
+class Limiter:
+    def __init__(self, backend):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._in_flight = {name: 0 for name in MAX_IN_FLIGHT}
+        self.counts = {name: {'allowed': 0, 'limited': 0, 'shed': 0} for name in RATE_LIMITS}
+
+    def _count(self, name, outcome):
+        with self._lock:
+            self.counts[name][outcome] += 1
+
+    def check(self, name, client):
+        capacity, rate = _parse(RATE_LIMITS[name])
+        try:
+            return self.backend.take('%s:%s' % (name, client), capacity, rate)
+        except Exception:
+            # Backend dùng chung lỗi thì cho qua, không chặn cả trang web
+            return 0
+
+    def admit(self, name):
+        with self._lock:
+            if self._in_flight[name] >= MAX_IN_FLIGHT[name]:
+                return False
+            self._in_flight[name] += 1
+            return True
+
+    def release(self, name):
+        with self._lock:
+            self._in_flight[name] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(self.counts[name], in_flight=self._in_flight[name],
+                               max_in_flight=MAX_IN_FLIGHT[name], limit=RATE_LIMITS[name])
+                    for name in RATE_LIMITS}
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            if RATE_LIMIT_REDIS_URL and redis:
+                _limiter = Limiter(RedisBackend(RATE_LIMIT_REDIS_URL))
+            else:
+                _limiter = Limiter(LocalBackend())
+        return _limiter
+
+
+def _client_id():
+    # Người đã đăng nhập tính theo tài khoản, khách tính theo IP (sau proxy: IP thật, xem TRUSTED_PROXIES)
+    if session.get('username'):
+        return 'user:%s' % session['username']
+    return 'ip:%s' % request.remote_addr
+
+
+def _reject(field, message, status, retry_after):
+    response = jsonify({'success': False, field: message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(max(1, int(math.ceil(retry_after))))
+    return response
+
+
+def limit(name, field='error'):
+    # field: khóa JSON mà client của route đó hiển thị (/chat đọc 'response')
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            limiter = get_limiter()
+            # Kiểm tra tải trước: request bị từ chối vì quá tải không tốn token của người dùng
+            if not limiter.admit(name):
+                limiter._count(name, 'shed')
+                return _reject(field, OVERLOADED_MESSAGE, 503, 1)
+            wait = limiter.check(name, _client_id())
+            if wait > 0:
+                limiter.release(name)
+                limiter._count(name, 'limited')
+                return _reject(field, RATE_LIMITED_MESSAGE, 429, wait)
+            limiter._count(name, 'allowed')
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                limiter.release(name)
+                raise
+            if isinstance(response, Response) and response.is_streamed:
+                # Response dạng stream: chỉ nhả slot khi stream kết thúc
+                response.call_on_close(lambda: limiter.release(name))
+            else:
+                limiter.release(name)
+            return response
+        return wrapper
+    return decorator
+
+
+def rate_limit_stats():
+    return get_limiter().stats()
@@ -0,0 +1,760 @@
+import datetime
+import json
+import re
+import threading
+import time
+import unicodedata
+import os
+from cache import LRUCache
+from db import USE_POSTGRES, IntegrityError, db_connection, execute_batch, transaction
+import metrics
+
+_stats_lock = threading.Lock()
+_statements = {}
+
+
+class Statement:
+    # Câu SQL viết một lần với placeholder '?', biên dịch sẵn cho từng backend.
+    # SQLite: dùng statement cache của sqlite3; Postgres: PREPARE một lần mỗi kết nối.
+    def __init__(self, name, sql, returning_id=False):
+        self.name = name
+        self.sql = sql
+        self.returning_id = returning_id and USE_POSTGRES
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+        parts = sql.split('?')
+        self.nparams = len(parts) - 1
+        pg_sql = parts[0] + ''.join('$%d%s' % (i + 1, part) for i, part in enumerate(parts[1:]))
+        if self.returning_id:
+            pg_sql += ' RETURNING id'
+        self.pg_prepare = 'PREPARE %s AS %s' % (name, pg_sql)
+        if self.nparams:
+            self.pg_execute = 'EXECUTE %s (%s)' % (name, ', '.join(['%s'] * self.nparams))
+        else:
+            self.pg_execute = 'EXECUTE %s' % name
+        _statements[name] = self
+
+    def run(self, conn, params=()):
+        start = time.perf_counter()
+        cur = conn.cursor()
+        if USE_POSTGRES:
+            if self.name not in conn.prepared:
+                cur.execute(self.pg_prepare)
+                conn.prepared.add(self.name)
+            cur.execute(self.pg_execute, params)
+        else:
+            cur.execute(self.sql, params)
+        self._record(time.perf_counter() - start, params)
+        return cur
+
+    def _record(self, elapsed, params):
+        metrics.observe_query(self.name, elapsed, params)
+        with _stats_lock:
+            self.calls += 1
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+
+    def one(self, conn, params=()):
+        return self.run(conn, params).fetchone()
+
+    def all(self, conn, params=()):
+        return self.run(conn, params).fetchall()
+
+    def many(self, conn, rows, page_size=100):
+        # Ghi nhiều dòng một lần: executemany (SQLite), gộp page_size lệnh EXECUTE mỗi round trip (Postgres)
+        if not rows:
+            return
+        start = time.perf_counter()
+        cur = conn.cursor()
+        if USE_POSTGRES:
+            if self.name not in conn.prepared:
+                cur.execute(self.pg_prepare)
+                conn.prepared.add(self.name)
+            execute_batch(cur, self.pg_execute, rows, page_size=page_size)
+        else:
+            cur.executemany(self.sql, rows)
+        self._record(time.perf_counter() - start, rows[0])
+
+    def insert(self, conn, params=()):
+        cur = self.run(conn, params)
+        if self.returning_id:
+            return cur.fetchone()[0]
+        return cur.lastrowid
+
+
+def statement_stats():
+    with _stats_lock:
+        return {name: {'calls': s.calls,
+                       'total_ms': round(s.total * 1000, 3),
+                       'max_ms': round(s.max * 1000, 3)}
+                for name, s in _statements.items() if s.calls}
+
+
+def _now():
+    return datetime.datetime.now()
+
+
+# Danh sách: chỉ lấy cột cần hiển thị, phân trang theo (created_at, id)
+PAGE_SIZE = 20
+EXCERPT_LENGTH = 200
+LESSON_LIST_COLUMNS = 'id, title, substr(content, 1, %d), author, created_at' % EXCERPT_LENGTH
+QUESTION_LIST_COLUMNS = ('id, title, substr(content, 1, %d), author, created_at, answers, views, last_activity_at'
+                         % (EXCERPT_LENGTH + 1))
+
+# Bài học
+LESSONS_PAGE_FIRST = Statement('lessons_page_first',
+                               'SELECT ' + LESSON_LIST_COLUMNS + ' FROM lessons WHERE status = ? '
+                               'ORDER BY created_at DESC, id DESC LIMIT ?')
+LESSONS_PAGE_AFTER = Statement('lessons_page_after',
+                               'SELECT ' + LESSON_LIST_COLUMNS + ' FROM lessons WHERE status = ? AND (created_at, id) < (?, ?) '
+                               'ORDER BY created_at DESC, id DESC LIMIT ?')
+LESSON_BY_ID = Statement('lesson_by_id', 'SELECT * FROM lessons WHERE id = ?')
+# Trang bài tập: đề bài và lời giải trong một truy vấn
+EXERCISE_DETAIL = Statement('exercise_detail',
+                            'SELECT l.id, l.title, l.exercise, '
+                            "CASE WHEN s.solution_code <> '' THEN 1 ELSE 0 END, "
+                            "CASE WHEN s.explanation <> '' THEN 1 ELSE 0 END FROM lessons l "
+                            'LEFT JOIN solutions s ON s.lesson_id = l.id WHERE l.id = ? ORDER BY s.id LIMIT 1')
+LESSON_INSERT = Statement('lesson_insert',
+                          'INSERT INTO lessons (title, content, code_example, exercise, video_url, author, created_at, status, type) '
+                          'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', returning_id=True)
+LESSON_UPDATE = Statement('lesson_update',
+                          'UPDATE lessons SET title = ?, content = ?, code_example = ?, exercise = ?, video_url = ? WHERE id = ?')
+LESSON_SET_STATUS = Statement('lesson_set_status', 'UPDATE lessons SET status = ? WHERE id = ?')
+LESSON_DELETE = Statement('lesson_delete', 'DELETE FROM lessons WHERE id = ?')
+LESSON_IDS_BY_STATUS = Statement('lesson_ids_by_status',
+                                 'SELECT id FROM lessons WHERE status = ? AND id > ? ORDER BY id LIMIT ?')
+LESSONS_COUNT_BY_STATUS = Statement('lessons_count_by_status', 'SELECT count(*) FROM lessons WHERE status = ?')
+LESSON_IDS_AFTER = Statement('lesson_ids_after', 'SELECT id FROM lessons WHERE id > ? ORDER BY id LIMIT ?')
+LESSONS_COUNT = Statement('lessons_count', 'SELECT count(*) FROM lessons')
+
+# Lời giải
+SOLUTION_BY_LESSON = Statement('solution_by_lesson', 'SELECT solution_code, explanation FROM solutions WHERE lesson_id = ?')
+SOLUTION_INSERT = Statement('solution_insert', 'INSERT INTO solutions (lesson_id, solution_code, explanation) VALUES (?, ?, ?)')
+SOLUTIONS_DELETE_BY_LESSON = Statement('solutions_delete_by_lesson', 'DELETE FROM solutions WHERE lesson_id = ?')
+
+# Test chấm bài
+TEST_CASES_BY_LESSON = Statement('test_cases_by_lesson',
+                                 'SELECT input, expected_output FROM test_cases WHERE lesson_id = ? ORDER BY position')
+TEST_CASE_INSERT = Statement('test_case_insert',
+                             'INSERT INTO test_cases (lesson_id, position, input, expected_output) VALUES (?, ?, ?, ?)')
+TEST_CASES_DELETE_BY_LESSON = Statement('test_cases_delete_by_lesson', 'DELETE FROM test_cases WHERE lesson_id = ?')
+
+# Hỏi đáp
+# Danh sách hỏi đáp sắp theo hoạt động gần nhất, đọc thẳng từ idx_questions_activity_id
+# Trang đầu kèm id câu hỏi mới nhất (cột cuối, cùng snapshot với trang) làm mốc cho cập nhật live
+QUESTIONS_PAGE_FIRST = Statement('questions_page_first',
+                                 'SELECT ' + QUESTION_LIST_COLUMNS + ', (SELECT max(id) FROM questions) FROM questions '
+                                 'ORDER BY last_activity_at DESC, id DESC LIMIT ?')
+QUESTIONS_PAGE_AFTER = Statement('questions_page_after',
+                                 'SELECT ' + QUESTION_LIST_COLUMNS + ' FROM questions WHERE (last_activity_at, id) < (?, ?) '
+                                 'ORDER BY last_activity_at DESC, id DESC LIMIT ?')
+# Trang câu hỏi: câu hỏi kèm một trang câu trả lời trong cùng một truy vấn.
+# Postgres tăng lượt xem ngay trong câu lệnh đó (UPDATE ... RETURNING), SQLite chạy UPDATE riêng.
+ANSWERS_PAGE_SIZE = 20
+# Cột cuối: id câu trả lời mới nhất của câu hỏi, làm mốc cho cập nhật live
+QUESTION_DETAIL_COLUMNS = ('q.id, q.title, q.content, q.author, q.created_at, q.answers, q.views, q.last_activity_at, '
+                           'a.id, a.question_id, a.content, a.author, a.created_at, '
+                           '(SELECT max(id) FROM answers WHERE question_id = q.id)')
+if USE_POSTGRES:
+    QUESTION_DETAIL_FIRST = Statement('question_detail_first',
+                                      'WITH q AS (UPDATE questions SET views = views + 1 WHERE id = ? RETURNING *) '
+                                      'SELECT ' + QUESTION_DETAIL_COLUMNS + ' FROM q '
+                                      'LEFT JOIN answers a ON a.question_id = q.id ORDER BY a.created_at, a.id LIMIT ?')
+else:
+    QUESTION_DETAIL_FIRST = Statement('question_detail_first',
+                                      'SELECT ' + QUESTION_DETAIL_COLUMNS + ' FROM questions q '
+                                      'LEFT JOIN answers a ON a.question_id = q.id WHERE q.id = ? '
+                                      'ORDER BY a.created_at, a.id LIMIT ?')
+QUESTION_DETAIL_AFTER = Statement('question_detail_after',
+                                  'SELECT ' + QUESTION_DETAIL_COLUMNS + ' FROM questions q '
+                                  'LEFT JOIN answers a ON a.question_id = q.id AND (a.created_at, a.id) > (?, ?) '
+                                  'WHERE q.id = ? ORDER BY a.created_at, a.id LIMIT ?')
+QUESTION_INSERT = Statement('question_insert',
+                            'INSERT INTO questions (title, content, author, created_at, last_activity_at) VALUES (?, ?, ?, ?, ?)',
+                            returning_id=True)
+QUESTION_ANSWERED = Statement('question_answered',
+                              'UPDATE questions SET answers = answers + 1, last_activity_at = ? WHERE id = ?')
+QUESTION_INC_VIEWS = Statement('question_inc_views', 'UPDATE questions SET views = views + 1 WHERE id = ?')
+QUESTION_DELETE = Statement('question_delete', 'DELETE FROM questions WHERE id = ?')
+ANSWER_CONTENTS_BY_QUESTION = Statement('answer_contents_by_question',
+                                        'SELECT content FROM answers WHERE question_id = ? ORDER BY created_at, id')
+QUESTIONS_AFTER_ID = Statement('questions_after_id',
+                               'SELECT id, title, content FROM questions WHERE id > ? ORDER BY id LIMIT ?')
+QUESTIONS_NEWER = Statement('questions_newer',
+                            'SELECT id, title, author, created_at FROM questions WHERE id > ? ORDER BY id LIMIT ?')
+ANSWERS_NEWER = Statement('answers_newer',
+                          'SELECT id, content, author, created_at FROM answers WHERE question_id = ? AND id > ? '
+                          'ORDER BY id LIMIT ?')
+QUESTIONS_COUNT = Statement('questions_count', 'SELECT count(*) FROM questions')
+ANSWER_INSERT = Statement('answer_insert',
+                          'INSERT INTO answers (question_id, content, author, created_at) VALUES (?, ?, ?, ?)', returning_id=True)
+
+# Người dùng
+USER_BY_NAME = Statement('user_by_name', 'SELECT id, username, password FROM users WHERE username = ?')
+USER_REHASH = Statement('user_rehash', 'UPDATE users SET password = ? WHERE username = ? AND password = ?')
+USER_INSERT = Statement('user_insert', 'INSERT INTO users (username, password, created_at) VALUES (?, ?, ?)')
+USER_UPDATE = Statement('user_update', 'UPDATE users SET username = ? WHERE username = ?')
+USER_UPDATE_PASSWORD = Statement('user_update_password', 'UPDATE users SET username = ?, password = ? WHERE username = ?')
+
+# Tìm kiếm: văn bản được bỏ dấu trước khi ghi vào search_documents
+SEARCH_DELETE = Statement('search_delete', 'DELETE FROM search_documents WHERE kind = ? AND ref_id = ?')
+SEARCH_INSERT = Statement('search_insert', 'INSERT INTO search_documents (kind, ref_id, title, body) VALUES (?, ?, ?, ?)')
+SEARCH_LESSON_INSERT = Statement('search_lesson_insert',
+                                 "INSERT INTO search_documents (kind, ref_id, title, body) "
+                                 "SELECT 'lesson', id, ?, ? FROM lessons WHERE id = ? AND status = 'approved'")
+SEARCH_APPEND = Statement('search_append', 'UPDATE search_documents SET body = body || ? WHERE kind = ? AND ref_id = ?')
+SEARCH_RESULT_COLUMNS = ('d.kind, d.ref_id, coalesce(l.title, q.title), '
+                         'substr(coalesce(l.content, q.content), 1, %d) ' % EXCERPT_LENGTH)
+SEARCH_RESULT_JOINS = ("LEFT JOIN lessons l ON d.kind = 'lesson' AND l.id = d.ref_id "
+                       "LEFT JOIN questions q ON d.kind = 'question' AND q.id = d.ref_id ")
+if USE_POSTGRES:
+    SEARCH = Statement('search',
+                       'SELECT ' + SEARCH_RESULT_COLUMNS + "FROM search_documents d CROSS JOIN to_tsquery('simple', ?) query "
+                       + SEARCH_RESULT_JOINS +
+                       "WHERE d.document @@ query AND (? = '' OR d.kind = ?) "
+                       'ORDER BY ts_rank(d.document, query) DESC, d.id DESC LIMIT ? OFFSET ?')
+else:
+    SEARCH = Statement('search',
+                       'SELECT ' + SEARCH_RESULT_COLUMNS + 'FROM search_fts JOIN search_documents d ON d.id = search_fts.rowid '
+                       + SEARCH_RESULT_JOINS +
+                       "WHERE search_fts MATCH ? AND (? = '' OR d.kind = ?) "
+                       'ORDER BY bm25(search_fts, 10.0, 1.0), d.id DESC LIMIT ? OFFSET ?')
+
+# Job chạy nền
+JOB_COLUMNS = 'id, kind, payload, status, total, done, error, created_by, created_at, started_at, finished_at'
+JOB_INSERT = Statement('job_insert',
+                       "INSERT INTO jobs (kind, payload, status, total, created_by, created_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                       returning_id=True)
+JOB_NEXT = Statement('job_next',
+                     "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat_at < ?) "
+                     'ORDER BY id LIMIT 1')
+JOB_CLAIM = Statement('job_claim',
+                      "UPDATE jobs SET status = 'running', started_at = ?, heartbeat_at = ? "
+                      "WHERE id = ? AND (status = 'queued' OR (status = 'running' AND heartbeat_at < ?))")
+JOB_BY_ID = Statement('job_by_id', 'SELECT ' + JOB_COLUMNS + ' FROM jobs WHERE id = ?')
+JOB_PROGRESS = Statement('job_progress', 'UPDATE jobs SET total = ?, done = ?, heartbeat_at = ? WHERE id = ?')
+JOB_FINISH = Statement('job_finish', 'UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?')
+JOBS_RECENT = Statement('jobs_recent', 'SELECT ' + JOB_COLUMNS + ' FROM jobs ORDER BY id DESC LIMIT ?')
+
+# Xuất / nhập hàng loạt: đọc theo lô id, bảng con lấy theo khoảng id của lô cha
+EXPORT_LESSONS = Statement('export_lessons',
+                           'SELECT id, title, content, code_example, exercise, video_url, author, created_at, status, type '
+                           'FROM lessons WHERE id > ? ORDER BY id LIMIT ?')
+EXPORT_SOLUTIONS = Statement('export_solutions',
+                             'SELECT lesson_id, solution_code, explanation FROM solutions '
+                             'WHERE lesson_id > ? AND lesson_id <= ? ORDER BY lesson_id, id')
+EXPORT_TEST_CASES = Statement('export_test_cases',
+                              'SELECT lesson_id, input, expected_output FROM test_cases '
+                              'WHERE lesson_id > ? AND lesson_id <= ? ORDER BY lesson_id, position')
+EXPORT_QUESTIONS = Statement('export_questions',
+                             'SELECT id, title, content, author, created_at, views, last_activity_at '
+                             'FROM questions WHERE id > ? ORDER BY id LIMIT ?')
+EXPORT_ANSWERS = Statement('export_answers',
+                           'SELECT question_id, content, author, created_at FROM answers '
+                           'WHERE question_id > ? AND question_id <= ? ORDER BY question_id, created_at, id')
+EXPORT_USERS = Statement('export_users', 'SELECT id, username, password, created_at FROM users WHERE id > ? ORDER BY id LIMIT ?')
+QUESTION_IMPORT = Statement('question_import',
+                            'INSERT INTO questions (title, content, author, created_at, answers, views, last_activity_at) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)', returning_id=True)
+USER_IMPORT = Statement('user_import',
+                        'INSERT INTO users (username, password, created_at) VALUES (?, ?, ?) ON CONFLICT (username) DO NOTHING')
+# Tham số là mảng (Postgres) hoặc chuỗi JSON của mảng (SQLite)
+USERS_EXISTING = Statement('users_existing',
+                           'SELECT username FROM users WHERE username = ANY(?)' if USE_POSTGRES else
+                           'SELECT username FROM users WHERE username IN (SELECT value FROM json_each(?))')
+# Bài học / câu hỏi đã nhập nhận ra theo (title, author, created_at); lọc theo created_at (mảng thời gian)
+LESSONS_EXISTING = Statement('lessons_existing',
+                             'SELECT title, author, created_at FROM lessons WHERE created_at = ANY(?)' if USE_POSTGRES else
+                             'SELECT title, author, created_at FROM lessons WHERE created_at IN (SELECT value FROM json_each(?))')
+QUESTIONS_EXISTING = Statement('questions_existing',
+                               'SELECT title, author, created_at FROM questions WHERE created_at = ANY(?)' if USE_POSTGRES else
+                               'SELECT title, author, created_at FROM questions WHERE created_at IN (SELECT value FROM json_each(?))')
+
+# Tiến độ học: upsert cộng dồn số đếm của cả lô đã gom trong bộ nhớ
+GREATEST = 'greatest' if USE_POSTGRES else 'max'
+LESSON_PROGRESS_UPSERT = Statement('lesson_progress_upsert',
+                                   'INSERT INTO lesson_progress (username, lesson_id, views, exercise_views, runs, submissions, '
+                                   'passed, first_seen_at, last_seen_at, passed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                                   'ON CONFLICT (username, lesson_id) DO UPDATE SET '
+                                   'views = lesson_progress.views + excluded.views, '
+                                   'exercise_views = lesson_progress.exercise_views + excluded.exercise_views, '
+                                   'runs = lesson_progress.runs + excluded.runs, '
+                                   'submissions = lesson_progress.submissions + excluded.submissions, '
+                                   'passed = %s(lesson_progress.passed, excluded.passed), '
+                                   'last_seen_at = %s(lesson_progress.last_seen_at, excluded.last_seen_at), '
+                                   'passed_at = coalesce(lesson_progress.passed_at, excluded.passed_at)' % (GREATEST, GREATEST))
+USER_PROGRESS_UPSERT = Statement('user_progress_upsert',
+                                 'INSERT INTO user_progress (username, views, runs, submissions, last_active_at) '
+                                 'VALUES (?, ?, ?, ?, ?) ON CONFLICT (username) DO UPDATE SET '
+                                 'views = user_progress.views + excluded.views, '
+                                 'runs = user_progress.runs + excluded.runs, '
+                                 'submissions = user_progress.submissions + excluded.submissions, '
+                                 'last_active_at = %s(user_progress.last_active_at, excluded.last_active_at)' % GREATEST)
+USER_PROGRESS = Statement('user_progress',
+                          'SELECT u.views, u.runs, u.submissions, u.last_active_at, '
+                          '(SELECT count(*) FROM lesson_progress p WHERE p.username = u.username), '
+                          '(SELECT count(*) FROM lesson_progress p WHERE p.username = u.username AND p.passed = 1) '
+                          'FROM user_progress u WHERE u.username = ?')
+LESSON_PROGRESS_RENAME = Statement('lesson_progress_rename', 'UPDATE lesson_progress SET username = ? WHERE username = ?')
+USER_PROGRESS_RENAME = Statement('user_progress_rename', 'UPDATE user_progress SET username = ? WHERE username = ?')
+LESSON_PROGRESS_RECENT = Statement('lesson_progress_recent',
+                                   'SELECT p.lesson_id, l.title, p.views, p.exercise_views, p.runs, p.submissions, p.passed, '
+                                   'p.last_seen_at FROM lesson_progress p JOIN lessons l ON l.id = p.lesson_id '
+                                   'WHERE p.username = ? ORDER BY p.last_seen_at DESC LIMIT ?')
+
+# Phiên bản tag của page cache
+PAGE_GENERATION = Statement('page_generation', 'SELECT generation FROM page_generations WHERE tag = ?')
+PAGE_GENERATION_BUMP = Statement('page_generation_bump',
+                                 'INSERT INTO page_generations (tag, generation) VALUES (?, 1) '
+                                 'ON CONFLICT (tag) DO UPDATE SET generation = page_generations.generation + 1')
+
+# Liên hệ
+CONTACTS_ALL = Statement('contacts_all', 'SELECT * FROM contacts ORDER BY created_at DESC')
+CONTACT_INSERT = Statement('contact_insert',
+                           'INSERT INTO contacts (username, subject, message, created_at) VALUES (?, ?, ?, ?)')
+CONTACT_DELETE = Statement('contact_delete', 'DELETE FROM contacts WHERE id = ?')
+
+
+def encode_cursor(row, column=4):
+    # Cursor của trang tiếp theo: cột sắp xếp (mặc định created_at) và id của dòng cuối
+    return '%s_%d' % (row[column].isoformat(), row[0])
+
+def decode_cursor(cursor):
+    try:
+        created_at, row_id = cursor.rsplit('_', 1)
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (AttributeError, ValueError):
+        return None
+
+def _page(rows, limit, column=4):
+    # Lấy dư một dòng để biết còn trang sau hay không
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1], column)
+    return rows, None
+
+def list_lessons_page(status, cursor=None, limit=PAGE_SIZE):
+    after = decode_cursor(cursor)
+    with db_connection(readonly=True) as conn:
+        if after:
+            rows = LESSONS_PAGE_AFTER.all(conn, (status, after[0], after[1], limit + 1))
+        else:
+            rows = LESSONS_PAGE_FIRST.all(conn, (status, limit + 1))
+    return _page(rows, limit)
+
+def get_lesson(lesson_id):
+    with db_connection(readonly=True) as conn:
+        return LESSON_BY_ID.one(conn, (lesson_id,))
+
+def _index_lesson(conn, lesson_id, title, content, code_example):
+    # Chỉ bài học đã duyệt mới có trong chỉ mục tìm kiếm
+    SEARCH_DELETE.run(conn, ('lesson', lesson_id))
+    SEARCH_LESSON_INSERT.run(conn, (fold_text(title), fold_text(content, code_example), lesson_id))
+
+def create_lesson(title, content, code_example, exercise, video_url, author, status, type,
+                  solution_code='', solution_explanation='', test_cases=()):
+    with transaction() as conn:
+        lesson_id = LESSON_INSERT.insert(conn, (title, content, code_example, exercise, video_url,
+                                                author, _now(), status, type))
+        _index_lesson(conn, lesson_id, title, content, code_example)
+        if solution_code:
+            SOLUTION_INSERT.run(conn, (lesson_id, solution_code, solution_explanation))
+        _insert_test_cases(conn, lesson_id, test_cases)
+    return lesson_id
+
+def update_lesson(lesson_id, title, content, code_example, exercise, video_url):
+    with transaction() as conn:
+        LESSON_UPDATE.run(conn, (title, content, code_example, exercise, video_url, lesson_id))
+        _index_lesson(conn, lesson_id, title, content, code_example)
+
+def _reindex_lesson(conn, lesson_id):
+    lesson = LESSON_BY_ID.one(conn, (lesson_id,))
+    if lesson:
+        _index_lesson(conn, lesson_id, lesson[1], lesson[2], lesson[3])
+
+def _delete_lesson(conn, lesson_id):
+    LESSON_DELETE.run(conn, (lesson_id,))
+    SOLUTIONS_DELETE_BY_LESSON.run(conn, (lesson_id,))
+    TEST_CASES_DELETE_BY_LESSON.run(conn, (lesson_id,))
+    SEARCH_DELETE.run(conn, ('lesson', lesson_id))
+
+def set_lesson_status(lesson_id, status):
+    with transaction() as conn:
+        LESSON_SET_STATUS.run(conn, (status, lesson_id))
+        _reindex_lesson(conn, lesson_id)
+
+def delete_lesson(lesson_id):
+    with transaction() as conn:
+        _delete_lesson(conn, lesson_id)
+
+def lesson_ids(status=None, after_id=0, limit=PAGE_SIZE):
+    # Duyệt id bài học theo thứ tự tăng dần, dùng cho các job xử lý theo lô
+    with db_connection() as conn:
+        if status is None:
+            rows = LESSON_IDS_AFTER.all(conn, (after_id, limit))
+        else:
+            rows = LESSON_IDS_BY_STATUS.all(conn, (status, after_id, limit))
+    return [row[0] for row in rows]
+
+def count_lessons(status=None):
+    with db_connection() as conn:
+        if status is None:
+            return LESSONS_COUNT.one(conn)[0]
+        return LESSONS_COUNT_BY_STATUS.one(conn, (status,))[0]
+
+def moderate_lessons(lesson_ids, action):
+    # Duyệt / từ chối / xóa một lô bài học trong một transaction
+    with transaction() as conn:
+        for lesson_id in lesson_ids:
+            if action == 'delete':
+                _delete_lesson(conn, lesson_id)
+            else:
+                LESSON_SET_STATUS.run(conn, ('approved' if action == 'approve' else 'rejected', lesson_id))
+                _reindex_lesson(conn, lesson_id)
+
+def reindex_lessons(lesson_ids):
+    with transaction() as conn:
+        for lesson_id in lesson_ids:
+            _reindex_lesson(conn, lesson_id)
+
+def reindex_questions(after_id=0, limit=PAGE_SIZE):
+    # Đánh chỉ mục lại một lô câu hỏi (kèm câu trả lời), trả về số câu hỏi đã xử lý và id cuối
+    with transaction() as conn:
+        questions = QUESTIONS_AFTER_ID.all(conn, (after_id, limit))
+        for question_id, title, content in questions:
+            answers = [row[0] for row in ANSWER_CONTENTS_BY_QUESTION.all(conn, (question_id,))]
+            SEARCH_DELETE.run(conn, ('question', question_id))
+            SEARCH_INSERT.run(conn, ('question', question_id, fold_text(title), fold_text(content, *answers)))
+    return len(questions), questions[-1][0] if questions else after_id
+
+def count_questions():
+    with db_connection() as conn:
+        return QUESTIONS_COUNT.one(conn)[0]
+
+def get_exercise(lesson_id):
+    # (id, tiêu đề, đề bài, có lời giải, có gợi ý) hoặc None; nội dung lời giải lấy qua /get_solution
+    with db_connection(readonly=True) as conn:
+        return EXERCISE_DETAIL.one(conn, (lesson_id,))
+
+def get_solution(lesson_id):
+    with db_connection(readonly=True) as conn:
+        return SOLUTION_BY_LESSON.one(conn, (lesson_id,))
+
+def _insert_test_cases(conn, lesson_id, test_cases):
+    for position, (input_text, expected_output) in enumerate(test_cases):
+        TEST_CASE_INSERT.run(conn, (lesson_id, position, input_text, expected_output))
+
+def get_test_cases(lesson_id):
+    with db_connection(readonly=True) as conn:
+        return TEST_CASES_BY_LESSON.all(conn, (lesson_id,))
+
+def replace_test_cases(lesson_id, test_cases):
+    with transaction() as conn:
+        TEST_CASES_DELETE_BY_LESSON.run(conn, (lesson_id,))
+        _insert_test_cases(conn, lesson_id, test_cases)
+
+def list_questions_page(cursor=None, limit=PAGE_SIZE):
+    after = decode_cursor(cursor)
+    with db_connection(readonly=True) as conn:
+        if after:
+            rows = QUESTIONS_PAGE_AFTER.all(conn, (after[0], after[1], limit + 1))
+        else:
+            rows = QUESTIONS_PAGE_FIRST.all(conn, (limit + 1,))
+    return _page(rows, limit, column=7)
+
+def get_question_detail(question_id, cursor=None, limit=ANSWERS_PAGE_SIZE):
+    # Trả về (câu hỏi, câu trả lời, cursor trang sau); trang đầu được tính một lượt xem.
+    # question[8] là id câu trả lời mới nhất (0 nếu chưa có)
+    after = decode_cursor(cursor)
+    if after:
+        with db_connection(readonly=True) as conn:
+            rows = QUESTION_DETAIL_AFTER.all(conn, (after[0], after[1], question_id, limit + 1))
+    else:
+        # Đếm lượt xem không khiến người xem bị gắn vào primary
+        with transaction(sticky=False) as conn:
+            if not USE_POSTGRES:
+                QUESTION_INC_VIEWS.run(conn, (question_id,))
+            rows = QUESTION_DETAIL_FIRST.all(conn, (question_id, limit + 1))
+    if not rows:
+        return None, [], None
+    answers = [row[8:13] for row in rows if row[8] is not None]
+    answers, next_cursor = _page(answers, limit)
+    return rows[0][:8] + (rows[0][13] or 0,), answers, next_cursor
+
+def new_questions(after_id, limit=PAGE_SIZE):
+    # Câu hỏi có id > after_id, dùng để gửi bù khi kết nối live nối lại
+    with db_connection() as conn:
+        return QUESTIONS_NEWER.all(conn, (after_id, limit))
+
+def new_answers(question_id, after_id, limit=PAGE_SIZE):
+    with db_connection() as conn:
+        return ANSWERS_NEWER.all(conn, (question_id, after_id, limit))
+
+def create_question(title, content, author):
+    now = _now()
+    with transaction() as conn:
+        question_id = QUESTION_INSERT.insert(conn, (title, content, author, now, now))
+        SEARCH_INSERT.run(conn, ('question', question_id, fold_text(title), fold_text(content)))
+    return question_id
+
+def create_answer(question_id, content, author):
+    # Trả về None nếu câu hỏi không còn. Cập nhật bộ đếm trước để giữ khóa ghi ngay từ đầu transaction
+    now = _now()
+    try:
+        with transaction() as conn:
+            if QUESTION_ANSWERED.run(conn, (now, question_id)).rowcount == 0:
+                return None
+            answer_id = ANSWER_INSERT.insert(conn, (question_id, content, author, now))
+            # Câu trả lời được nối vào tài liệu của câu hỏi, không đánh chỉ mục lại từ đầu
+            SEARCH_APPEND.run(conn, (' ' + fold_text(content), 'question', question_id))
+    except IntegrityError:
+        return None
+    return answer_id
+
+def delete_question(question_id):
+    # Câu trả lời bị xóa theo khóa ngoại ON DELETE CASCADE
+    with transaction() as conn:
+        QUESTION_DELETE.run(conn, (question_id,))
+        SEARCH_DELETE.run(conn, ('question', question_id))
+
+def fold_text(*parts):
+    # Bỏ dấu tiếng Việt (kể cả đ -> d) để "vòng lặp" khớp "vong lap"
+    text = ' '.join(part for part in parts if part)
+    text = unicodedata.normalize('NFD', text.replace('đ', 'd').replace('Đ', 'D'))
+    return ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+
+def _search_query(text):
+    # Mọi từ đều phải có mặt, từ cuối khớp theo tiền tố khi đang gõ dở
+    words = re.findall(r'\w+', fold_text(text))[:10]
+    if not words:
+        return None
+    if USE_POSTGRES:
+        return ' & '.join(words[:-1] + [words[-1] + ':*'])
+    return ' '.join(['"%s"' % word for word in words[:-1]] + ['"%s"*' % words[-1]])
+
+def search(text, kind='', page=1, limit=PAGE_SIZE):
+    # Trả về (kết quả, còn trang sau); mỗi dòng: kind, id, tiêu đề, trích đoạn
+    query = _search_query(text)
+    if query is None:
+        return [], False
+    with db_connection(readonly=True) as conn:
+        rows = SEARCH.all(conn, (query, kind, kind, limit + 1, (page - 1) * limit))
+    return rows[:limit], len(rows) > limit
+
+# Cache user theo username cho các đợt đăng nhập dồn dập; xóa khi user đổi thông tin.
+# Process khác đổi mật khẩu thì cache ở đây cũ tối đa USER_CACHE_TTL giây.
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))
+_user_cache = LRUCache(1024 * 1024, ttl=USER_CACHE_TTL)
+
+def get_user(username):
+    # (id, username, password hash) hoặc None
+    user = _user_cache.get(username)
+    if user is None:
+        with db_connection() as conn:
+            user = USER_BY_NAME.one(conn, (username,))
+        if user is not None:
+            _user_cache.set(username, tuple(user), len(username) + len(user[2]) + 64)
+    return user
+
+def rehash_user_password(username, old_hash, new_hash):
+    # Chỉ ghi nếu hash chưa bị đổi bởi request khác
+    with transaction() as conn:
+        USER_REHASH.run(conn, (new_hash, username, old_hash))
+    _user_cache.delete(username)
+
+def create_user(username, password_hash):
+    # Trả về False nếu tên người dùng đã tồn tại
+    try:
+        with transaction() as conn:
+            USER_INSERT.run(conn, (username, password_hash, _now()))
+        return True
+    except IntegrityError:
+        return False
+
+def update_user(current_username, new_username, password_hash=None):
+    with transaction() as conn:
+        if password_hash:
+            USER_UPDATE_PASSWORD.run(conn, (new_username, password_hash, current_username))
+        else:
+            USER_UPDATE.run(conn, (new_username, current_username))
+        if new_username != current_username:
+            LESSON_PROGRESS_RENAME.run(conn, (new_username, current_username))
+            USER_PROGRESS_RENAME.run(conn, (new_username, current_username))
+    _user_cache.delete(current_username)
+    _user_cache.delete(new_username)
+
+def create_job(kind, payload, total, created_by):
+    with transaction() as conn:
+        return JOB_INSERT.insert(conn, (kind, payload, total, created_by, _now()))
+
+def claim_next_job(stale_before):
+    # Nhận job đang chờ (hoặc job mà worker cũ đã chết); UPDATE có điều kiện nên chỉ một worker nhận được
+    with transaction() as conn:
+        row = JOB_NEXT.one(conn, (stale_before,))
+        if row is None:
+            return None
+        now = _now()
+        if JOB_CLAIM.run(conn, (now, now, row[0], stale_before)).rowcount == 0:
+            return None
+        return JOB_BY_ID.one(conn, (row[0],))
+
+def update_job_progress(job_id, total, done):
+    with transaction() as conn:
+        JOB_PROGRESS.run(conn, (total, done, _now(), job_id))
+
+def finish_job(job_id, status, error=None):
+    with transaction() as conn:
+        JOB_FINISH.run(conn, (status, error, _now(), job_id))
+
+def get_job(job_id):
+    with db_connection() as conn:
+        return JOB_BY_ID.one(conn, (job_id,))
+
+def list_jobs(limit=PAGE_SIZE):
+    with db_connection() as conn:
+        return JOBS_RECENT.all(conn, (limit,))
+
+EXPORT_BATCH_SIZE = 500
+
+def _group(rows):
+    # Gom các dòng con theo id cha (cột đầu tiên)
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(tuple(row[1:]))
+    return groups
+
+def export_lessons(batch_size=EXPORT_BATCH_SIZE):
+    # Sinh (lesson, solution hoặc None, [(input, expected_output)]); chỉ giữ một lô trong bộ nhớ
+    after_id = 0
+    while True:
+        with db_connection() as conn:
+            lessons = EXPORT_LESSONS.all(conn, (after_id, batch_size))
+            if not lessons:
+                return
+            last_id = lessons[-1][0]
+            solutions = _group(EXPORT_SOLUTIONS.all(conn, (after_id, last_id)))
+            test_cases = _group(EXPORT_TEST_CASES.all(conn, (after_id, last_id)))
+        for lesson in lessons:
+            yield lesson, solutions.get(lesson[0], [None])[0], test_cases.get(lesson[0], [])
+        after_id = last_id
+
+def export_questions(batch_size=EXPORT_BATCH_SIZE):
+    # Sinh (question, [(content, author, created_at)])
+    after_id = 0
+    while True:
+        with db_connection() as conn:
+            questions = EXPORT_QUESTIONS.all(conn, (after_id, batch_size))
+            if not questions:
+                return
+            last_id = questions[-1][0]
+            answers = _group(EXPORT_ANSWERS.all(conn, (after_id, last_id)))
+        for question in questions:
+            yield question, answers.get(question[0], [])
+        after_id = last_id
+
+def export_users(batch_size=EXPORT_BATCH_SIZE):
+    after_id = 0
+    while True:
+        with db_connection() as conn:
+            users = EXPORT_USERS.all(conn, (after_id, batch_size))
+        if not users:
+            return
+        yield from users
+        after_id = users[-1][0]
+
+def _existing_keys(conn, statement, times):
+    times = [value for value in times if value is not None]
+    rows = statement.all(conn, (times if USE_POSTGRES else json.dumps([str(value) for value in times]),))
+    return {tuple(row) for row in rows}
+
+def import_lessons(records):
+    # records: [(lesson, solution hoặc None, test_cases)], lesson theo thứ tự cột của LESSON_INSERT.
+    # Cả lô trong một transaction; id mới do database cấp. Bài học đã có (cùng title, author, created_at,
+    # ví dụ nhập lại cùng một file) thì bỏ qua; trả về số bài học thực sự được thêm
+    written = 0
+    with transaction() as conn:
+        seen = _existing_keys(conn, LESSONS_EXISTING, [record[0][6] for record in records])
+        solutions = []
+        test_cases = []
+        for lesson, solution, tests in records:
+            key = (lesson[0], lesson[5], lesson[6])
+            if key in seen:
+                continue
+            seen.add(key)
+            written += 1
+            lesson_id = LESSON_INSERT.insert(conn, lesson)
+            _index_lesson(conn, lesson_id, lesson[0], lesson[1], lesson[2])
+            if solution:
+                solutions.append((lesson_id,) + tuple(solution))
+            test_cases.extend((lesson_id, position) + tuple(test) for position, test in enumerate(tests))
+        SOLUTION_INSERT.many(conn, solutions)
+        TEST_CASE_INSERT.many(conn, test_cases)
+    return written
+
+def import_questions(records):
+    # records: [((title, content, author, created_at, views, last_activity_at), [(content, author, created_at)])]
+    # Câu hỏi đã có (cùng title, author, created_at) thì bỏ qua cả câu trả lời; trả về số câu hỏi được thêm
+    written = 0
+    with transaction() as conn:
+        seen = _existing_keys(conn, QUESTIONS_EXISTING, [record[0][3] for record in records])
+        answers = []
+        documents = []
+        for (title, content, author, created_at, views, last_activity_at), question_answers in records:
+            if (title, author, created_at) in seen:
+                continue
+            seen.add((title, author, created_at))
+            written += 1
+            question_id = QUESTION_IMPORT.insert(conn, (title, content, author, created_at, len(question_answers),
+                                                        views, last_activity_at or created_at))
+            answers.extend((question_id,) + tuple(answer) for answer in question_answers)
+            documents.append(('question', question_id, fold_text(title),
+                              fold_text(content, *[answer[0] for answer in question_answers])))
+        ANSWER_INSERT.many(conn, answers)
+        SEARCH_INSERT.many(conn, documents)
+    return written
+
+def import_users(records):
+    # Tên người dùng đã có (hoặc lặp lại trong file) thì bỏ qua, không ghi đè mật khẩu.
+    # Trả về số người dùng thực sự được thêm
+    usernames = [record[0] for record in records]
+    with transaction() as conn:
+        existing = USERS_EXISTING.all(conn, (usernames if USE_POSTGRES else json.dumps(usernames),))
+        USER_IMPORT.many(conn, records)
+    return len(set(usernames) - {row[0] for row in existing})
+
+def record_progress(lesson_rows, user_rows):
+    # Gọi từ thread flush của progress.py, không nằm trên đường xử lý request
+    with transaction() as conn:
+        LESSON_PROGRESS_UPSERT.many(conn, lesson_rows)
+        USER_PROGRESS_UPSERT.many(conn, user_rows)
+
+def get_progress(username, limit=PAGE_SIZE):
+    # (tổng: views, runs, submissions, last_active_at, số bài đã mở, số bài đã đạt), [bài gần đây]
+    with db_connection(readonly=True) as conn:
+        summary = USER_PROGRESS.one(conn, (username,))
+        lessons = LESSON_PROGRESS_RECENT.all(conn, (username, limit))
+    return summary, lessons
+
+def get_page_generations(tags):
+    # Đọc từ primary: replica còn trễ sẽ trả về phiên bản cũ
+    with db_connection() as conn:
+        return [(PAGE_GENERATION.one(conn, (tag,)) or (0,))[0] for tag in tags]
+
+def bump_page_generations(tags):
+    with transaction(sticky=False) as conn:
+        PAGE_GENERATION_BUMP.many(conn, [(tag,) for tag in tags])
+
+def list_contacts():
+    with db_connection() as conn:
+        return CONTACTS_ALL.all(conn)
+
+def create_contact(username, subject, message):
+    with transaction() as conn:
+        CONTACT_INSERT.run(conn, (username, subject, message, _now()))
+
+def delete_contact(contact_id):
+    with transaction() as conn:
+        CONTACT_DELETE.run(conn, (contact_id,))
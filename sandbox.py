@@ -0,0 +1,780 @@
+import atexit
+import base64
+import dis
+import hashlib
+import io
+import json
+import logging
+import marshal
+import os
+import queue
+import re
+import secrets
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Giới hạn cho mỗi lần chạy code của người học
+WORKERS = int(os.environ.get('RUN_CODE_WORKERS', 4))
+QUEUE_SIZE = int(os.environ.get('RUN_CODE_QUEUE', 32))
+QUEUE_TIMEOUT = float(os.environ.get('RUN_CODE_QUEUE_TIMEOUT', 10))
+WALL_TIMEOUT = float(os.environ.get('RUN_CODE_TIMEOUT', 5))
+CPU_SECONDS = int(os.environ.get('RUN_CODE_CPU', 3))
+MEMORY_MB = int(os.environ.get('RUN_CODE_MEMORY_MB', 256))
+OUTPUT_KB = int(os.environ.get('RUN_CODE_OUTPUT_KB', 64))
+# Phiên chạy tương tác (streaming + nhập dữ liệu) được phép chờ input lâu hơn
+SESSION_TIMEOUT = float(os.environ.get('RUN_CODE_SESSION_TIMEOUT', 120))
+# Phiên tương tác có số slot riêng, không chiếm worker của /run_code và chấm bài
+SESSION_WORKERS = int(os.environ.get('RUN_CODE_SESSION_WORKERS', 4))
+# Chương trình chờ input quá lâu thì dừng để trả slot
+INPUT_TIMEOUT = float(os.environ.get('RUN_CODE_INPUT_TIMEOUT', 30))
+# Chấm bài: thời gian tối đa cho mỗi test
+CASE_TIMEOUT = float(os.environ.get('RUN_CODE_CASE_TIMEOUT', 2))
+STREAM_CHUNK = 4096
+# Cache bytecode và kết quả của các đoạn code chạy lặp lại (theo hash nội dung)
+BYTECODE_CACHE_MB = int(os.environ.get('RUN_CODE_BYTECODE_CACHE_MB', 16))
+RESULT_CACHE_MB = int(os.environ.get('RUN_CODE_RESULT_CACHE_MB', 16))
+
+# Chỉ cache kết quả khi code không đọc input, không import module ngoài danh sách này
+# và không dùng gì có thể cho kết quả khác nhau giữa các lần chạy
+DETERMINISTIC_MODULES = {'math', 'string', 'itertools', 'functools', 'collections', 're', 'json',
+                         'fractions', 'decimal', 'operator', 'heapq', 'bisect', 'statistics', 'textwrap'}
+NONDETERMINISTIC_NAMES = {'input', 'open', 'id', 'hash', 'set', 'frozenset', 'object', 'globals', 'locals',
+                          'vars', 'eval', 'exec', 'compile', '__import__', 'breakpoint', 'memoryview', 'help'}
+NONDETERMINISTIC_OPS = {'BUILD_SET', 'SET_ADD', 'SET_UPDATE', 'LOAD_BUILD_CLASS'}
+# Output có địa chỉ bộ nhớ (repr mặc định như <function f at 0x7f...>) khác nhau giữa các lần chạy
+ADDRESS_PATTERN = re.compile(r'0x[0-9a-fA-F]{6,}')
+
+# Worker chỉ nhận các biến môi trường tối thiểu, không thấy khóa API, SECRET_KEY... của app
+WORKER_ENV = {'PATH': os.environ.get('PATH', '/usr/bin:/bin'), 'PYTHONIOENCODING': 'utf-8'}
+# Worker luôn chạy bằng user riêng này (không đọc/ghi được file, database và /proc của app),
+# vì vậy app phải chạy bằng root; không đổi được user thì không chạy code của người học
+WORKER_USER = os.environ.get('RUN_CODE_USER', 'nobody')
+# Python cho worker, phải cùng phiên bản với app (bytecode cache gửi xuống bằng marshal) và user
+# ở trên phải chạy được (Python cài trong /root thì trỏ biến này sang bản cài chung, ví dụ /usr/bin/python3.11)
+WORKER_PYTHON = os.environ.get('RUN_CODE_PYTHON', sys.executable)
+PR_SET_DUMPABLE = 4
+
+
+class ExecutorBusy(Exception):
+    pass
+
+
+class SandboxUnavailable(Exception):
+    # Không cô lập được worker khỏi app: từ chối chạy code thay vì chạy chung user với app
+    pass
+
+
+class OutputLimitExceeded(BaseException):
+    # BaseException để code người học không bắt được bằng `except Exception`
+    pass
+
+
+class CaseTimeout(BaseException):
+    pass
+
+
+class BoundedOutput(io.StringIO):
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+        if self.size > self.limit:
+            super().write(s[:max(0, self.limit - (self.size - len(s)))])
+            raise OutputLimitExceeded()
+        return super().write(s)
+
+
+def _send(message):
+    sys.__stdout__.write(json.dumps(message) + '\n')
+    sys.__stdout__.flush()
+
+
+class StreamOutput(io.TextIOBase):
+    # Gửi output về tiến trình cha theo từng dòng thay vì giữ toàn bộ trong bộ nhớ
+    encoding = 'utf-8'
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.size += len(s)
+        if self.size > self.limit:
+            self._buffer.append(s[:max(0, self.limit - (self.size - len(s)))])
+            self.flush()
+            raise OutputLimitExceeded()
+        self._buffer.append(s)
+        self._buffered += len(s)
+        if '\n' in s or self._buffered >= STREAM_CHUNK:
+            self.flush()
+        return len(s)
+
+    def flush(self):
+        if self._buffer:
+            _send({'type': 'output', 'data': ''.join(self._buffer)})
+            self._buffer = []
+            self._buffered = 0
+
+    def getvalue(self):
+        return ''
+
+
+class StreamInput(io.TextIOBase):
+    # input() của người học: báo cho tiến trình cha rồi chờ dữ liệu gửi xuống
+    encoding = 'utf-8'
+
+    def __init__(self, output):
+        self.output = output
+
+    def readable(self):
+        return True
+
+    def readline(self, size=-1):
+        self.output.flush()
+        _send({'type': 'input'})
+        line = sys.__stdin__.readline()
+        if not line:
+            return ''
+        return json.loads(line).get('input', '') + '\n'
+
+
+def _apply_limits(limits):
+    if resource is None:
+        return
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = int(used.ru_utime + used.ru_stime) + limits['cpu_seconds']
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    memory = limits['memory_mb'] * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (1024 * 1024, 1024 * 1024))
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+
+
+def _cpu_ms():
+    if resource is None:
+        return None
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    return round((used.ru_utime + used.ru_stime) * 1000, 1)
+
+
+def execute(code, output, stdin=None):
+    # Chạy code (source hoặc code object) trong namespace riêng, output ghi vào đối tượng có giới hạn kích thước
+    old_stdout, old_stderr, old_stdin = sys.stdout, sys.stderr, sys.stdin
+    sys.stdout = sys.stderr = output
+    if stdin is not None:
+        sys.stdin = stdin
+    try:
+        if isinstance(code, str):
+            code = compile(code, '<code>', 'exec')
+        exec(code, {'__name__': '__main__'})
+        result = {'success': True}
+    except SystemExit:
+        result = {'success': True}
+    except CaseTimeout:
+        result = {'success': False, 'error': 'Hết thời gian chạy test'}
+    except OutputLimitExceeded:
+        result = {'success': False, 'error': 'Output quá dài (tối đa %d KB)' % (output.limit // 1024)}
+    except MemoryError:
+        result = {'success': False, 'error': 'Vượt quá giới hạn bộ nhớ'}
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    finally:
+        sys.stdout, sys.stderr, sys.stdin = old_stdout, old_stderr, old_stdin
+    output.flush()
+    result['output'] = output.getvalue()
+    return result
+
+
+def _normalize(text):
+    return '\n'.join(line.rstrip() for line in text.strip().splitlines())
+
+
+def _on_case_timeout(signum, frame):
+    raise CaseTimeout()
+
+
+def run_cases(code, inputs, output_limit, case_timeout, nonce):
+    # Chạy lần lượt từng input và gửi output thô về; đáp án không bao giờ vào worker,
+    # tiến trình cha tự so sánh. Mỗi test một dòng bắt đầu bằng nonce của lần chấm.
+    signal.signal(signal.SIGALRM, _on_case_timeout)
+    for index, input_text in enumerate(inputs):
+        start = time.perf_counter()
+        signal.setitimer(signal.ITIMER_REAL, case_timeout)
+        try:
+            run = execute(code, BoundedOutput(output_limit), io.StringIO(input_text))
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+        run.update(index=index, time_ms=round((time.perf_counter() - start) * 1000, 2))
+        sys.__stdout__.write('\n' + nonce + json.dumps(run) + '\n')
+        sys.__stdout__.flush()
+    return {'success': True}
+
+
+def _worker_main():
+    # Tiến trình worker: nhận một job (JSON) qua stdin, chạy với giới hạn tài nguyên rồi thoát.
+    # Chế độ thường: trả kết quả ở dòng cuối stdout.
+    # Chế độ stream: gửi từng message JSON (output / input / result), nhận input qua stdin.
+    line = sys.stdin.readline()
+    if not line:
+        return
+    job = json.loads(line)
+    _apply_limits(job['limits'])
+    limit = job['limits']['output_bytes']
+    code = job['code']
+    if job.get('bytecode'):
+        code = marshal.loads(base64.b64decode(job['bytecode']))
+    cpu_start = _cpu_ms()
+    if 'inputs' in job:
+        result = run_cases(code, job['inputs'], limit, job['case_timeout'], job.pop('nonce'))
+    elif job.get('stream'):
+        output = StreamOutput(limit)
+        result = execute(code, output, StreamInput(output))
+        del result['output']
+    else:
+        result = execute(code, BoundedOutput(limit))
+    if cpu_start is not None:
+        result['cpu_ms'] = round(_cpu_ms() - cpu_start, 1)
+    if job.get('stream'):
+        result['type'] = 'result'
+        _send(result)
+    else:
+        sys.__stdout__.write('\n' + json.dumps(result) + '\n')
+        sys.__stdout__.flush()
+
+
+def _unavailable(reason):
+    logging.getLogger('sandbox').error('không chạy code của người học: %s', reason)
+    return SandboxUnavailable(reason)
+
+
+def _worker_user():
+    # (uid, gid) riêng cho worker; chỉ đổi user được khi app chạy bằng root
+    if not hasattr(os, 'geteuid') or os.geteuid() != 0:
+        raise _unavailable('app phải chạy bằng root để đổi worker sang RUN_CODE_USER')
+    try:
+        import pwd
+        entry = pwd.getpwnam(WORKER_USER)
+    except (ImportError, KeyError):
+        raise _unavailable('không có user %r (RUN_CODE_USER)' % WORKER_USER)
+    if entry.pw_uid == os.geteuid():
+        raise _unavailable('RUN_CODE_USER phải khác user của app')
+    # Thử trước: user đó phải chạy được WORKER_PYTHON (Python cài trong /root thì không)
+    try:
+        subprocess.run([WORKER_PYTHON, '-I', '-c', ''], user=entry.pw_uid, group=entry.pw_gid, extra_groups=[],
+                       cwd='/', env=WORKER_ENV, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=10, check=True)
+    except (OSError, subprocess.SubprocessError):
+        raise _unavailable('user %s không chạy được %s (đặt RUN_CODE_PYTHON)' % (WORKER_USER, WORKER_PYTHON))
+    return entry.pw_uid, entry.pw_gid
+
+
+def _set_not_dumpable():
+    # /proc/<pid>/environ, mem... của app chỉ root đọc được, kể cả khi có lỗ hổng cho worker cùng uid
+    if not sys.platform.startswith('linux'):
+        return
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.prctl(PR_SET_DUMPABLE, 0, 0, 0, 0) != 0:
+        raise _unavailable('prctl(PR_SET_DUMPABLE) lỗi: %s' % os.strerror(ctypes.get_errno()))
+
+
+def code_key(code):
+    return hashlib.sha256(code.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def is_deterministic(code_object):
+    # Duyệt bytecode (kể cả hàm lồng nhau) để quyết định có cache được output hay không
+    for instruction in dis.get_instructions(code_object):
+        if instruction.opname in NONDETERMINISTIC_OPS:
+            return False
+        if instruction.opname == 'IMPORT_NAME' and instruction.argval.split('.')[0] not in DETERMINISTIC_MODULES:
+            return False
+        if instruction.opname in ('LOAD_NAME', 'LOAD_GLOBAL') and instruction.argval in NONDETERMINISTIC_NAMES:
+            return False
+    for const in code_object.co_consts:
+        if hasattr(const, 'co_code') and not is_deterministic(const):
+            return False
+    return True
+
+
+class RunSession:
+    # Một lần chạy tương tác: output đẩy dần qua hàng đợi, input gửi xuống worker
+    def __init__(self, executor, process, owner):
+        self.id = secrets.token_urlsafe(16)
+        self.owner = owner
+        self.executor = executor
+        self.process = process
+        self.started = time.perf_counter()
+        self.deadline = time.monotonic() + executor.session_timeout
+        self.closed = False
+        self.input_expired = False
+        self._input_timer = None
+        # Hàng đợi có giới hạn: client đọc chậm thì worker bị chặn khi ghi output
+        self.messages = queue.Queue(maxsize=64)
+        self._stdin_lock = threading.Lock()
+        # Client không bao giờ mở stream: vẫn dừng worker khi hết hạn
+        self._reaper = threading.Timer(executor.session_timeout + 5, self._reap)
+        self._reaper.daemon = True
+        self._reaper.start()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _put(self, message):
+        # Không còn ai đọc (closed) thì bỏ message để _read chạy tới _session_done và trả slot
+        while not self.closed:
+            try:
+                self.messages.put(message, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _read(self):
+        result = None
+        for line in self.process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get('type') == 'result':
+                result = message
+            else:
+                if message.get('type') == 'input':
+                    self._wait_input()
+                self._put(message)
+        self.process.wait()
+        self._reaper.cancel()
+        self._cancel_input()
+        if result is None:
+            result = self.executor._exit_error(self.process)
+            if self.input_expired:
+                result['error'] = 'Quá %g giây không nhập dữ liệu, chương trình đã dừng' % self.executor.input_timeout
+            result['type'] = 'result'
+        result['time_ms'] = round((time.perf_counter() - self.started) * 1000, 1)
+        self._put(result)
+        self.executor._session_done(self)
+
+    def _wait_input(self):
+        self._input_timer = threading.Timer(self.executor.input_timeout, self._expire_input)
+        self._input_timer.daemon = True
+        self._input_timer.start()
+
+    def _cancel_input(self):
+        if self._input_timer is not None:
+            self._input_timer.cancel()
+
+    def _expire_input(self):
+        self.input_expired = True
+        self.kill()
+
+    def send_input(self, text):
+        self._cancel_input()
+        with self._stdin_lock:
+            try:
+                self.process.stdin.write(json.dumps({'input': text}) + '\n')
+                self.process.stdin.flush()
+                return True
+            except (BrokenPipeError, ValueError, OSError):
+                return False
+
+    def kill(self):
+        self.executor._kill(self.process)
+
+    def _reap(self):
+        # Quá hạn mà events() chưa đóng phiên: không ai đọc nữa, output còn lại bị bỏ
+        self.closed = True
+        self.kill()
+
+    def events(self, heartbeat=15):
+        # Sinh các message cho tới khi có kết quả; None là nhịp heartbeat
+        try:
+            while True:
+                remaining = self.deadline - time.monotonic()
+                if remaining <= 0:
+                    self.kill()
+                    with self.executor._lock:
+                        self.executor.timeouts += 1
+                    yield {'type': 'result', 'success': False,
+                           'error': 'Hết thời gian phiên chạy (tối đa %g giây)' % self.executor.session_timeout}
+                    return
+                try:
+                    message = self.messages.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    yield None
+                    continue
+                yield message
+                if message.get('type') == 'result':
+                    return
+        finally:
+            # Client ngắt kết nối hoặc chương trình kết thúc: dừng worker
+            self.closed = True
+            self.kill()
+
+
+class CodeExecutor:
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, queue_timeout=QUEUE_TIMEOUT,
+                 wall_timeout=WALL_TIMEOUT, cpu_seconds=CPU_SECONDS, memory_mb=MEMORY_MB, output_kb=OUTPUT_KB):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.wall_timeout = wall_timeout
+        self.limits = {'cpu_seconds': cpu_seconds, 'memory_mb': memory_mb, 'output_bytes': output_kb * 1024}
+        self.pid = os.getpid()
+        self.user = _worker_user()
+        _set_not_dumpable()
+        # Worker chạy từ mã nguồn truyền qua -c nên không cần quyền đọc thư mục của app
+        with open(os.path.abspath(__file__), encoding='utf-8') as source:
+            self.command = [WORKER_PYTHON, '-I', '-c', source.read(), '--worker']
+        self._slots = threading.BoundedSemaphore(workers)
+        self.session_workers = SESSION_WORKERS
+        self._session_slots = threading.BoundedSemaphore(SESSION_WORKERS)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._waiting = 0
+        self._running = 0
+        self._refill = threading.Event()
+        self._sessions = {}
+        self.session_timeout = SESSION_TIMEOUT
+        self.input_timeout = INPUT_TIMEOUT
+        self.case_timeout = CASE_TIMEOUT
+        # Worker chạy với -I nên không import được module của app; chỉ tiến trình cha dùng cache
+        from cache import LRUCache
+        self.bytecode_cache = LRUCache(BYTECODE_CACHE_MB * 1024 * 1024)
+        self.result_cache = LRUCache(RESULT_CACHE_MB * 1024 * 1024)
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.killed = 0
+        self.run_total = 0.0
+        self.run_max = 0.0
+        threading.Thread(target=self._refill_loop, daemon=True).start()
+        self._refill.set()
+
+    def _spawn(self):
+        # Mỗi worker: thư mục làm việc tạm riêng (xóa khi worker xong), process group riêng
+        # để giết được cả các tiến trình con nó tạo ra
+        workdir = tempfile.mkdtemp(prefix='sandbox-')
+        os.chown(workdir, *self.user)
+        try:
+            process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL, text=True, encoding='utf-8', close_fds=True,
+                                       cwd=workdir, env=WORKER_ENV, start_new_session=True,
+                                       user=self.user[0], group=self.user[1], extra_groups=[])
+        except Exception:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+        process.workdir = workdir
+        return process
+
+    def _kill(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _discard(self, process):
+        # Worker chỉ chạy một job: dọn các tiến trình con còn sót và thư mục tạm của nó
+        self._kill(process)
+        process.wait()
+        shutil.rmtree(process.workdir, ignore_errors=True)
+
+    def _refill_loop(self):
+        # Luôn giữ sẵn các worker đã khởi động để request không phải chờ tạo tiến trình
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while True:
+                with self._lock:
+                    if len(self._idle) + self._running >= self.workers:
+                        break
+                worker = self._spawn()
+                with self._lock:
+                    self._idle.append(worker)
+
+    def _take_worker(self, session=False):
+        # Worker của phiên tương tác không tính vào _running: pool sẽ nạp bù worker khác cho /run_code
+        with self._lock:
+            if not session:
+                self._running += 1
+            while self._idle:
+                process = self._idle.pop()
+                if process.poll() is None:
+                    return process
+                self._discard(process)
+        return self._spawn()
+
+    def shutdown(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for process in idle:
+            self._discard(process)
+
+    def _acquire(self, timeout=None):
+        with self._lock:
+            if self._waiting >= self.queue_size:
+                self.rejected += 1
+                raise ExecutorBusy()
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=timeout or self.queue_timeout)
+        with self._lock:
+            self._waiting -= 1
+            if not acquired:
+                self.rejected += 1
+        if not acquired:
+            raise ExecutorBusy()
+
+    def _compile(self, key, code):
+        # Trả về (bytecode base64, có cache kết quả được không) hoặc lỗi cú pháp
+        cached = self.bytecode_cache.get(key)
+        if cached is not None:
+            return cached, None
+        try:
+            code_object = compile(code, '<code>', 'exec')
+        except (SyntaxError, ValueError, RecursionError, MemoryError) as e:
+            return None, {'success': False, 'output': '', 'error': str(e)}
+        compiled = (base64.b64encode(marshal.dumps(code_object)).decode('ascii'), is_deterministic(code_object))
+        self.bytecode_cache.set(key, compiled, len(compiled[0]) + len(key))
+        return compiled, None
+
+    def run(self, code):
+        key = code_key(code)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return dict(cached, time_ms=0, cached=True)
+        compiled, error = self._compile(key, code)
+        if error is not None:
+            # Lỗi cú pháp không cần tới worker
+            self.result_cache.set(key, error, len(error['error']) + len(key))
+            return dict(error, time_ms=0)
+        bytecode, deterministic = compiled
+        self._acquire()
+        try:
+            job = {'code': code, 'bytecode': bytecode, 'limits': self.limits}
+            result = self._run_in_worker(job, self.wall_timeout)
+        finally:
+            self._slots.release()
+        if deterministic and result.get('success') and not ADDRESS_PATTERN.search(result['output']):
+            self.result_cache.set(key, result, len(result['output']) + len(key) + 64)
+        return result
+
+    def grade(self, code, cases, wait=None):
+        # Chấm một bài nộp: toàn bộ test chạy trong một worker
+        compiled, error = self._compile(code_key(code), code)
+        if error is not None:
+            return dict(error, passed=0, total=len(cases), cases=[], time_ms=0)
+        timeout = self.case_timeout * len(cases) + 1
+        limits = dict(self.limits, cpu_seconds=int(timeout) + 1)
+        self._acquire(wait)
+        try:
+            job = {'code': code, 'bytecode': compiled[0], 'limits': limits, 'case_timeout': self.case_timeout,
+                   'inputs': [case['input'] for case in cases], 'nonce': secrets.token_hex(16)}
+            result = self._run_in_worker(job, timeout, cases)
+        finally:
+            self._slots.release()
+        result.setdefault('passed', 0)
+        result.setdefault('total', len(cases))
+        result.setdefault('cases', [])
+        return result
+
+    def start_session(self, code, owner):
+        compiled, error = self._compile(code_key(code), code)
+        # Hết slot phiên thì từ chối ngay: phiên có thể kéo dài tới SESSION_TIMEOUT nên không xếp hàng chờ
+        if not self._session_slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorBusy()
+        process = None
+        try:
+            process = self._take_worker(session=True)
+            job = {'code': code, 'limits': self.limits, 'stream': True}
+            if compiled is not None:
+                job['bytecode'] = compiled[0]
+            process.stdin.write(json.dumps(job) + '\n')
+            process.stdin.flush()
+        except Exception:
+            if process is not None:
+                self._discard(process)
+            self._session_slots.release()
+            raise
+        self._refill.set()
+        session = RunSession(self, process, owner)
+        with self._lock:
+            self._sessions[session.id] = session
+        return session
+
+    def get_session(self, session_id, owner):
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None or session.owner != owner:
+            return None
+        return session
+
+    def _session_done(self, session):
+        elapsed = time.perf_counter() - session.started
+        with self._lock:
+            self._sessions.pop(session.id, None)
+            self.completed += 1
+            self.run_total += elapsed
+            self.run_max = max(self.run_max, elapsed)
+        self._discard(session.process)
+        self._session_slots.release()
+        self._refill.set()
+
+    def _run_in_worker(self, job, timeout, cases=None):
+        process = self._take_worker()
+        start = time.perf_counter()
+        try:
+            stdout, _ = process.communicate(json.dumps(job) + '\n', timeout=timeout)
+            if cases is None:
+                result = self._parse(process, stdout)
+            else:
+                result = self._check_cases(process, stdout, job['nonce'], cases)
+        except subprocess.TimeoutExpired:
+            self._kill(process)
+            process.communicate()
+            with self._lock:
+                self.timeouts += 1
+            result = {'success': False, 'output': '',
+                      'error': 'Hết thời gian chạy (tối đa %g giây)' % timeout}
+        finally:
+            elapsed = time.perf_counter() - start
+            self._discard(process)
+            with self._lock:
+                self._running -= 1
+                self.completed += 1
+                self.run_total += elapsed
+                self.run_max = max(self.run_max, elapsed)
+            self._refill.set()
+        result['time_ms'] = round(elapsed * 1000, 1)
+        return result
+
+    def _parse(self, process, stdout):
+        lines = stdout.rstrip('\n').rsplit('\n', 1)
+        if process.returncode == 0 and lines:
+            try:
+                return json.loads(lines[-1])
+            except ValueError:
+                pass
+        return self._exit_error(process)
+
+    def _check_cases(self, process, stdout, nonce, cases):
+        # Chỉ nhận các dòng có nonce, đúng thứ tự test và không thừa; dòng giả mạo làm lệch thứ tự
+        # thì cả lần chấm không hợp lệ
+        runs = []
+        for line in stdout.split('\n'):
+            if not line.startswith(nonce):
+                continue
+            try:
+                run = json.loads(line[len(nonce):])
+            except ValueError:
+                run = None
+            if not isinstance(run, dict) or run.get('index') != len(runs) or len(runs) >= len(cases):
+                return {'success': False, 'output': '', 'error': 'Kết quả chấm không hợp lệ'}
+            runs.append(run)
+        stopped = None
+        if len(runs) < len(cases):
+            if process.returncode:
+                stopped = self._exit_error(process)
+            else:
+                stopped = {'success': False, 'output': '', 'error': 'Chương trình kết thúc trước khi chạy hết các test'}
+        results = []
+        for index, case in enumerate(cases):
+            run = runs[index] if index < len(runs) else stopped
+            output = run.get('output') or ''
+            passed = run.get('success') is True and _normalize(output) == _normalize(case['expected'])
+            case_result = {'passed': passed, 'time_ms': run.get('time_ms', 0)}
+            if not passed:
+                case_result.update({'input': case['input'], 'expected': case['expected'],
+                                    'output': output[:1000], 'error': run.get('error')})
+            results.append(case_result)
+            if not passed:
+                break
+        passed = sum(1 for case in results if case['passed'])
+        return {'success': passed == len(cases), 'passed': passed, 'total': len(cases), 'cases': results}
+
+    def _exit_error(self, process):
+        with self._lock:
+            self.killed += 1
+        if process.returncode == -signal.SIGXCPU:
+            error = 'Vượt quá giới hạn CPU (%d giây)' % self.limits['cpu_seconds']
+        elif process.returncode == -signal.SIGXFSZ:
+            error = 'Không được ghi file lớn'
+        else:
+            error = 'Chương trình bị dừng (mã %s)' % process.returncode
+        return {'success': False, 'output': '', 'error': error}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'idle': len(self._idle),
+                'running': self._running,
+                'queued': self._waiting,
+                'sessions': len(self._sessions),
+                'session_workers': self.session_workers,
+                'queue_size': self.queue_size,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'killed': self.killed,
+                'run_avg_ms': round(self.run_total / self.completed * 1000, 1) if self.completed else 0,
+                'run_max_ms': round(self.run_max * 1000, 1),
+                'bytecode_cache': self.bytecode_cache.stats(),
+                'result_cache': self.result_cache.stats(),
+            }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None or _executor.pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor.pid != os.getpid():
+                _executor = CodeExecutor()
+                atexit.register(_executor.shutdown)
+    return _executor
+
+
+def run(code):
+    return get_executor().run(code)
+
+
+def start_session(code, owner):
+    return get_executor().start_session(code, owner)
+
+
+def get_session(session_id, owner):
+    return get_executor().get_session(session_id, owner)
+
+
+def grade(code, cases, wait=None):
+    return get_executor().grade(code, cases, wait)
+
+
+def executor_stats(start=True):
+    # start=False: không khởi động pool worker chỉ để đọc số liệu
+    if not start and (_executor is None or _executor.pid != os.getpid()):
+        return None
+    return get_executor().stats()
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['--worker']:
+    _worker_main()
@@ -0,0 +1,190 @@
+import csv
+import datetime
+import io
+import json
+import os
+import page_cache
+import repository
+
+# Sao lưu / chuyển dữ liệu giữa SQLite và Postgres. Mỗi bản ghi là một object JSON;
+# bảng con (lời giải, test, câu trả lời) lồng trong bản ghi cha, với CSV thì mã hóa JSON trong một cột.
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+FIELDS = {
+    'lessons': ('title', 'content', 'code_example', 'exercise', 'video_url', 'author', 'created_at', 'status', 'type',
+                'solution', 'test_cases'),
+    'questions': ('title', 'content', 'author', 'created_at', 'views', 'last_activity_at', 'answers'),
+    'users': ('username', 'password', 'created_at'),
+}
+NESTED = ('solution', 'test_cases', 'answers')
+# Ghi ra client theo khối khoảng 64KB thay vì từng dòng
+CHUNK_BYTES = 64 * 1024
+
+
+class TransferError(ValueError):
+    pass
+
+
+def _time(value):
+    return value.isoformat(' ') if value else None
+
+
+def _parse_time(value, line):
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise TransferError('Dòng %d: thời gian không hợp lệ "%s"' % (line, value))
+
+
+def _records(kind):
+    if kind == 'lessons':
+        for lesson, solution, test_cases in repository.export_lessons():
+            yield {
+                'title': lesson[1], 'content': lesson[2], 'code_example': lesson[3], 'exercise': lesson[4],
+                'video_url': lesson[5], 'author': lesson[6], 'created_at': _time(lesson[7]), 'status': lesson[8],
+                'type': lesson[9],
+                'solution': {'code': solution[0], 'explanation': solution[1]} if solution else None,
+                'test_cases': [{'input': test[0], 'expected_output': test[1]} for test in test_cases],
+            }
+    elif kind == 'questions':
+        for question, answers in repository.export_questions():
+            yield {
+                'title': question[1], 'content': question[2], 'author': question[3], 'created_at': _time(question[4]),
+                'views': question[5], 'last_activity_at': _time(question[6]),
+                'answers': [{'content': answer[0], 'author': answer[1], 'created_at': _time(answer[2])}
+                            for answer in answers],
+            }
+    else:
+        for user in repository.export_users():
+            yield {'username': user[1], 'password': user[2], 'created_at': _time(user[3])}
+
+
+def export(kind, fmt):
+    # Generator trả về các khối chuỗi, dùng trực tiếp làm body của Response
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, FIELDS[kind], lineterminator='\n')
+        writer.writeheader()
+    for record in _records(kind):
+        if writer:
+            writer.writerow({key: json.dumps(value, ensure_ascii=False) if key in NESTED else value
+                             for key, value in record.items()})
+        else:
+            buffer.write(json.dumps(record, ensure_ascii=False))
+            buffer.write('\n')
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def read(stream, fmt):
+    # stream: file nhị phân; sinh (số dòng, bản ghi) để báo lỗi đúng vị trí
+    text = io.TextIOWrapper(stream, encoding='utf-8', newline='' if fmt == 'csv' else None)
+    if fmt == 'csv':
+        csv.field_size_limit(64 * 1024 * 1024)
+        reader = csv.DictReader(text)
+        for record in reader:
+            line = reader.line_num
+            for key in NESTED:
+                if record.get(key):
+                    try:
+                        record[key] = json.loads(record[key])
+                    except ValueError:
+                        raise TransferError('Dòng %d: cột %s không phải JSON' % (line, key))
+            yield line, record
+        return
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        try:
+            yield line, json.loads(raw)
+        except ValueError:
+            raise TransferError('Dòng %d: không phải JSON' % line)
+
+
+def _objects(line, record, key):
+    # Bảng con lồng trong bản ghi: danh sách các object
+    value = record.get(key) or []
+    if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+        raise TransferError('Dòng %d: %s phải là danh sách object' % (line, key))
+    return value
+
+
+def _lesson(line, record):
+    if not record.get('title'):
+        raise TransferError('Dòng %d: thiếu title' % line)
+    solution = record.get('solution') or None
+    if solution is not None and not isinstance(solution, dict):
+        raise TransferError('Dòng %d: solution phải là object' % line)
+    return (
+        (record['title'], record.get('content') or '', record.get('code_example') or '', record.get('exercise') or '',
+         record.get('video_url') or '', record.get('author') or 'admin',
+         _parse_time(record.get('created_at'), line) or datetime.datetime.now(),
+         record.get('status') or 'approved', record.get('type') or 'course'),
+        (solution.get('code') or '', solution.get('explanation') or '') if solution else None,
+        [(test.get('input') or '', test.get('expected_output') or '') for test in _objects(line, record, 'test_cases')],
+    )
+
+
+def _question(line, record):
+    if not record.get('title'):
+        raise TransferError('Dòng %d: thiếu title' % line)
+    created_at = _parse_time(record.get('created_at'), line) or datetime.datetime.now()
+    answers = [(answer.get('content') or '', answer.get('author') or '',
+                _parse_time(answer.get('created_at'), line) or created_at)
+               for answer in _objects(line, record, 'answers')]
+    try:
+        views = int(record.get('views') or 0)
+    except (TypeError, ValueError):
+        raise TransferError('Dòng %d: views không phải số' % line)
+    return (
+        (record['title'], record.get('content') or '', record.get('author') or '', created_at,
+         views, _parse_time(record.get('last_activity_at'), line)),
+        answers,
+    )
+
+
+def _user(line, record):
+    if not record.get('username') or not record.get('password'):
+        raise TransferError('Dòng %d: thiếu username hoặc password' % line)
+    return record['username'], record['password'], _parse_time(record.get('created_at'), line) or datetime.datetime.now()
+
+
+CONVERTERS = {'lessons': _lesson, 'questions': _question, 'users': _user}
+IMPORTERS = {'lessons': repository.import_lessons, 'questions': repository.import_questions,
+             'users': repository.import_users}
+
+
+def import_stream(kind, stream, fmt, batch_size=IMPORT_BATCH_SIZE):
+    # Mỗi lô một transaction; gặp dòng lỗi thì dừng, các lô trước đó đã được ghi.
+    # Trả về (số bản ghi đã ghi, số bản ghi bỏ qua vì đã có: tên người dùng trùng, bài học / câu hỏi
+    # cùng title, author, created_at), nên nhập lại cùng một file không tạo bản sao.
+    convert = CONVERTERS[kind]
+    write = IMPORTERS[kind]
+    batch = []
+    imported = skipped = 0
+    try:
+        for line, record in read(stream, fmt):
+            if not isinstance(record, dict):
+                raise TransferError('Dòng %d: bản ghi phải là object' % line)
+            batch.append(convert(line, record))
+            if len(batch) >= batch_size:
+                written = write(batch)
+                imported += written
+                skipped += len(batch) - written
+                batch = []
+        if batch:
+            written = write(batch)
+            imported += written
+            skipped += len(batch) - written
+    finally:
+        if imported:
+            page_cache.invalidate('all')
+    return imported, skipped
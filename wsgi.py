@@ -0,0 +1,3 @@
+# Điểm vào cho WSGI server: gunicorn -c gunicorn.conf.py wsgi:app
+# Worker không chạy migration; schema được cập nhật một lần bởi gunicorn.conf.py hoặc "flask --app main init-db"
+from main import app